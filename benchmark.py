@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+# Measures what the wrapper itself costs per call, with a stub eprover that
+# prints a strategy or a proof instantly, so no real prover is needed:
+# 1.) For every --sizes N, a data dir gets a history of N synthetic strategies,
+#     and the steps of a call are timed in this process: folding the whole log
+#     (what compaction does), loading the snapshot, folding a tail of --tail new
+#     records, merging the master, and whole getStratPaths calls.
+# 2.) --calls incrementalEWrapper.py processes, --concurrency at a time, are run
+#     against a data dir with --concurrentSize strategies and $SLH_TRACE set; the
+#     per-phase times from its trace.jsonl and the lock wait/hold times are reported.
+#
+# Usage: python benchmark.py --sizes 10 1000 10000 100000 --concurrency 16 --calls 128 --json before.json
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+from stratClient import getStratPaths
+from helpers import appendStratHistory, compactStratHistory, loadStratSnapshot, foldStratLog, \
+    makeMasterFromHistory, loadStratHistory, traceSummary, lockStats, dataDirLockPath, summarizeValues
+
+STUB_EPROVER = """#!/usr/bin/env python3
+import sys, zlib
+args = sys.argv[1:]
+if "--version" in args:
+    print("E 0.0 (benchmark stub)")
+    sys.exit(0)
+h = zlib.crc32(open(args[-1], "rb").read())
+if "--print-strategy" in args:
+    print("{\\n   {")
+    print('      heuristic_def:  "(%d.Clauseweight(ConstPrio,2,1,1),%d.FIFOWeight(PreferProcessed))"' % (h % 7 + 1, h % 3 + 1))
+    for i in range(40):
+        print("      key%d:  %d" % (i, (h >> (i % 24)) % (2 + i % 5)))
+    print("   }\\n   no_preproc:  false\\n   sine:  \\"Auto\\"\\n}")
+    sys.stdout.flush()
+    sys.exit(0)
+print("# Proof found!\\n# SZS status Theorem\\n# Processed clauses                    : %d" % (h % 1000))
+"""
+
+CEFS = [f"{name}({arg})" for name in ["Clauseweight", "FIFOWeight", "Refinedweight", "ConjectureRelativeSymbolWeight"]
+        for arg in ["ConstPrio,2,1,1", "PreferProcessed", "PreferGoals,1,1,2,1.5,2", "SimulateSOS,0.5,100,100"]]
+
+def syntheticStrat(rng):
+    # Shaped like the strategies E prints: mostly small-domain options, some skewed, and a heuristic.
+    strat = {"heuristic_def": tuple(sorted((rng.randint(1, 10), cef) for cef in rng.sample(CEFS, rng.randint(2, 5))))}
+    for i in range(40):
+        strat[f"key{i}"] = min(int(rng.expovariate(1.0)), 2 + i % 5)
+    strat["no_preproc"] = False
+    strat["sine"] = rng.choice(["", "Auto", "GSinE(CountFormulas,hypos,1.5,,3,20000,1.0)"])
+    return strat
+
+def makeStub(stubDir):
+    os.makedirs(stubDir, exist_ok=True)
+    for executable in ["eprover", "eprover-ho"]:
+        path = f"{stubDir}/{executable}"
+        with open(path, "w") as f:
+            f.write(STUB_EPROVER)
+        os.chmod(path, 0o755)
+
+def makeProblems(problemDir, n):
+    os.makedirs(problemDir, exist_ok=True)
+    problems = []
+    for i in range(n):
+        problems.append(f"{problemDir}/bench_prob_{i % max(1, n // 4)}_{i}.p")
+        with open(problems[-1], "w") as f:
+            f.write(f"fof(a{i}, axiom, p{i}).\nfof(c, conjecture, p{i}).\n")
+    return problems
+
+def syntheticStrats(n, distinct, seed=0):
+    # --auto picks each problem's strategy from a fixed set, some far more often than others,
+    # so n strategies are drawn from `distinct` synthetic ones with Zipf-like frequencies.
+    rng = random.Random(seed)
+    pool = [syntheticStrat(rng) for _ in range(distinct)]
+    weights = [1 / (i + 1) for i in range(distinct)]
+    return rng.choices(pool, weights, k=n)
+
+def makeHistory(dataDir, n, distinct):
+    # Appends n synthetic strategies to dataDir's log, and returns how long
+    # building the history from the whole log and snapshotting it took.
+    os.makedirs(dataDir, exist_ok=True)
+    strats = syntheticStrats(n, distinct)
+    for start in range(0, n, 1000):
+        appendStratHistory(dataDir, *strats[start:start + 1000])
+    t1 = time.perf_counter()
+    compactStratHistory(dataDir)
+    return time.perf_counter() - t1
+
+def timeIt(f, repeat):
+    times = []
+    for _ in range(repeat):
+        t1 = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - t1)
+    return summarizeValues(sorted(times))
+
+def benchmarkMerge(workDir, size, distinct, tail, repeat):
+    dataDir = f"{workDir}/merge_{size}"
+    results = {"compact": makeHistory(dataDir, size, distinct)}
+    results["loadSnapshot"] = timeIt(lambda: loadStratSnapshot(dataDir), repeat)
+
+    hist, offset = loadStratSnapshot(dataDir)
+    appendStratHistory(dataDir, *syntheticStrats(tail, distinct, seed=1))
+    t1 = time.perf_counter()
+    foldStratLog(hist, dataDir, offset)
+    results[f"fold{tail}"] = time.perf_counter() - t1
+
+    results["master"] = timeIt(lambda: makeMasterFromHistory(hist, dataDir), repeat)
+    results["masterUnchanged"] = timeIt(lambda: makeMasterFromHistory(hist, dataDir), repeat)
+
+    problems = makeProblems(f"{workDir}/problems_{size}", repeat)
+    loadStratHistory(dataDir) # Warm the per-process cache, as a daemon or an experiment worker would have it.
+    calls = iter(problems)
+    results["getStratPaths"] = timeIt(lambda: getStratPaths(next(calls), dataDir, False), repeat)
+    return results
+
+def benchmarkConcurrent(workDir, size, distinct, calls, concurrency):
+    dataDir = f"{workDir}/concurrent_{size}"
+    makeHistory(dataDir, size, distinct)
+    problems = makeProblems(f"{workDir}/problems_concurrent", calls)
+    wrapper = os.path.join(os.path.dirname(os.path.abspath(__file__)), "incrementalEWrapper.py")
+    env = {**os.environ, "SLH_PERSISTENT_DATA_DIR": dataDir, "SLH_TRACE": "1"}
+
+    t1 = time.perf_counter()
+    running = []
+    for problem in problems:
+        if len(running) >= concurrency:
+            running.pop(0).wait()
+        running.append(subprocess.Popen([sys.executable, wrapper, problem], env=env, stdout=subprocess.DEVNULL))
+    for p in running:
+        p.wait()
+    wall = time.perf_counter() - t1
+
+    return {"callsPerSecond": calls / wall, "phases": traceSummary(dataDir), "lock": lockStats(dataDirLockPath(dataDir))}
+
+def printSummary(name, summary):
+    if isinstance(summary, dict):
+        stats = ", ".join(f"{k} {v * 1000:.2f}" if k != "count" else f"n {v}" for k, v in summary.items())
+        print(f"  {name:<20} {stats} (ms)")
+    else:
+        print(f"  {name:<20} {summary * 1000:.2f} ms")
+
+
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000, 100000], help="history sizes to time merging at")
+    parser.add_argument("--distinct", type=int, default=300, help="distinct strategies the synthetic histories are drawn from")
+    parser.add_argument("--tail", type=int, default=1000, help="log records appended after the snapshot")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--concurrentSize", type=int, default=10000, help="history size for the concurrent wrapper calls")
+    parser.add_argument("--calls", type=int, default=64, help="wrapper calls to make (0 to skip)")
+    parser.add_argument("--concurrency", type=int, default=os.cpu_count())
+    parser.add_argument("--json", default=None, help="also write the results to this file, to compare runs")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    args = parser.parse_args()
+
+    workDir = tempfile.mkdtemp(prefix="slh_benchmark_")
+    makeStub(f"{workDir}/stub")
+    os.environ["SLH_EPROVER_DIR"] = f"{workDir}/stub"
+    results = {"merge": {}, "concurrent": None}
+    try:
+        for size in args.sizes:
+            print(f"History of {size} strategies:")
+            results["merge"][size] = benchmarkMerge(workDir, size, args.distinct, args.tail, args.repeat)
+            for name, summary in results["merge"][size].items():
+                printSummary(name, summary)
+
+        if args.calls > 0:
+            print(f"{args.calls} wrapper calls, {args.concurrency} at a time, history of {args.concurrentSize}:")
+            results["concurrent"] = benchmarkConcurrent(workDir, args.concurrentSize, args.distinct, args.calls, args.concurrency)
+            print(f"  {results['concurrent']['callsPerSecond']:.2f} calls/s")
+            for phase, summary in results["concurrent"]["phases"].items():
+                printSummary(phase, summary)
+            for k in ["wait", "hold"]:
+                printSummary(f"lock {k}", results["concurrent"]["lock"][k])
+    finally:
+        if args.keep:
+            print(f"Scratch directory: {workDir}")
+        else:
+            shutil.rmtree(workDir)
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
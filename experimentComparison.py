@@ -0,0 +1,151 @@
+import sys
+import json
+import numpy as np
+
+from incrementalExperiments import Experiment, safePercent
+
+# Comparing many experiments over a large corpus:
+# ResultMatrix lines every experiment's results up as (problems x experiments)
+# NumPy arrays, so solved-by-all, unique solves, the virtual best solver,
+# pairwise wins and cactus plot series are all single array operations.
+#
+# From IPython:
+#   from experimentComparison import ResultMatrix
+#   m = ResultMatrix.load("A.results.jsonl", "B.results.jsonl", ...)
+#   m.report()
+
+
+def iterResults(path):
+    # Yields (experiment name, list of its problems or None) and then one dict per result,
+    # reading .results.jsonl logs line by line rather than building an Experiment.
+    if path.endswith(".jsonl"):
+        with open(path) as f:
+            header = json.loads(f.readline())["experiment"]
+            yield header["name"], header["problems"]
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue # Cut short by a crash.
+                if "problem" in entry and entry.get("final", True):
+                    yield entry
+    else:
+        exp = Experiment.load(path)
+        yield exp.name, exp.problems
+        usageMap = getattr(exp, "usageMap", {})
+        for problem, solved in exp.successMap.items():
+            yield {"problem": problem, "solved": solved, "processed": exp.procCountMap.get(problem),
+                   **usageMap.get(problem, {})}
+
+
+class ResultMatrix:
+    # Rows are problems, columns are experiments. A problem an experiment never
+    # attempted is unsolved with NaN costs in that column.
+
+    def __init__(self, names, problems, attempted, solved, processed, wall, cpu):
+        self.names = names
+        self.problems = problems
+        self.attempted = attempted
+        self.solved = solved
+        self.processed = processed
+        self.wall = wall
+        self.cpu = cpu
+
+    @staticmethod
+    def load(*paths):
+        names, columns = [], []
+        rowOf = {}
+        for path in paths:
+            results = iterResults(path)
+            name, problems = next(results)
+            for p in problems or []:
+                rowOf.setdefault(p, len(rowOf))
+
+            rows, solved, processed, wall, cpu = [], [], [], [], []
+            for r in results:
+                rows.append(rowOf.setdefault(r["problem"], len(rowOf)))
+                solved.append(r["solved"])
+                processed.append(np.nan if r.get("processed") is None else r["processed"])
+                wall.append(r.get("wall", np.nan))
+                cpu.append(r["user"] + r["sys"] if "user" in r else r.get("cpu", np.nan))
+            names.append(name)
+            columns.append((rows, solved, processed, wall, cpu))
+
+        shape = (len(rowOf), len(paths))
+        attempted = np.zeros(shape, dtype=bool)
+        solved = np.zeros(shape, dtype=bool)
+        processed, wall, cpu = np.full(shape, np.nan), np.full(shape, np.nan), np.full(shape, np.nan)
+        for j, (rows, s, p, w, c) in enumerate(columns):
+            rows = np.asarray(rows, dtype=np.int64)
+            attempted[rows, j] = True
+            solved[rows, j] = s
+            processed[rows, j] = p
+            wall[rows, j] = w
+            cpu[rows, j] = c
+
+        problems = np.empty(len(rowOf), dtype=object)
+        problems[list(rowOf.values())] = list(rowOf.keys())
+        return ResultMatrix(names, problems, attempted, solved, processed, wall, cpu)
+
+    def solvedByAll(self):
+        return self.solved.all(axis=1)
+
+    def uniqueSolves(self):
+        # Per experiment: problems that it alone solved.
+        return (self.solved & (self.solved.sum(axis=1) == 1)[:, None]).sum(axis=0)
+
+    def winMatrix(self):
+        # wins[i, j] = problems experiment i solved and experiment j did not.
+        s = self.solved.astype(np.int64)
+        return s.T @ (1 - s)
+
+    def virtualBest(self, metric="cpu"):
+        # Per problem: the cheapest cost of any experiment that solved it
+        # (inf if none did, NaN if the solvers' costs weren't recorded).
+        cost = np.fmin.reduce(np.where(self.solved, getattr(self, metric), np.inf), axis=1)
+        cost[self.solved.any(axis=1) & np.isinf(cost)] = np.nan
+        return cost
+
+    def cactus(self, metric="cpu"):
+        # {name: (sorted costs of solved problems, 1..n)} for each experiment and the virtual best.
+        cost = getattr(self, metric)
+        series = {}
+        for j, name in enumerate(self.names):
+            x = cost[self.solved[:, j], j]
+            x = np.sort(x[~np.isnan(x)])
+            series[name] = (x, np.arange(1, len(x) + 1))
+        vbs = self.virtualBest(metric)
+        x = np.sort(vbs[np.isfinite(vbs)])
+        series["virtual best"] = (x, np.arange(1, len(x) + 1))
+        return series
+
+    def report(self, metric="cpu"):
+        n = len(self.problems)
+        byAll = self.solvedByAll()
+        vbs = self.solved.any(axis=1).sum()
+        vbsCost = self.virtualBest(metric)
+        print(f"Problems: {n}")
+        print(f"Solved by all: {byAll.sum()} / {n} ({safePercent(byAll.sum(), n)}%)")
+        print(f"Virtual best solver: {vbs} / {n} ({safePercent(vbs, n)}%), "
+              f"{metric} time total {vbsCost[np.isfinite(vbsCost)].sum():.2f} s")
+
+        unique = self.uniqueSolves()
+        for j, name in enumerate(self.names):
+            solved = self.solved[:, j].sum()
+            common = self.processed[byAll, j]
+            print(f"\n{name}: solved {solved} / {self.attempted[:, j].sum()} attempted, {unique[j]} uniquely")
+            if byAll.any():
+                print(f"  Over problems solved by all: processed clauses mean {np.nanmean(common):.2f}, "
+                      f"median {np.nanmedian(common):.0f}; {metric} time total {np.nansum(getattr(self, metric)[byAll, j]):.2f} s")
+
+        wins = self.winMatrix()
+        width = max(len(name) for name in self.names)
+        print("\nWins (row solved, column did not):")
+        print(" " * width + "".join(f"{j:>8}" for j in range(len(self.names))))
+        for i, name in enumerate(self.names):
+            print(f"{name:>{width}}" + "".join(f"{w:>8}" for w in wins[i]) + f"   ({i})")
+
+
+
+if __name__ == "__main__":
+    ResultMatrix.load(*sys.argv[1:]).report()
@@ -1,14 +1,22 @@
 #!/bin/bash
 
+# The experiment scripts can read a subset directly with --manifest=<path_to_subset.txt>.
+# This script is for when a directory is needed: it hard links (or, with --symlink,
+# symlinks) the listed files into <problem_path>_filtered in one pass, instead of copying them.
+
 # Check if two arguments are provided
-if [ "$#" -ne 2 ]; then
-    echo "Usage: $0 <problem_path> <path_to_subset.txt>"
+if [ "$#" -lt 2 ] || [ "$#" -gt 3 ] || { [ "$#" -eq 3 ] && [ "$3" != "--symlink" ]; }; then
+    echo "Usage: $0 <problem_path> <path_to_subset.txt> [--symlink]"
     exit 1
 fi
 
 # Assign arguments to variables
 PROBLEM_PATH=$1
 SUBSET_PATH=$2
+LINK_FLAGS="-f"
+if [ "$3" == "--symlink" ]; then
+    LINK_FLAGS="-sf"
+fi
 
 # Ensure PROBLEM_PATH and SUBSET_PATH are valid
 if [ ! -d "$PROBLEM_PATH" ]; then
@@ -28,18 +36,20 @@ BASE_NAME=$(basename "$PROBLEM_PATH")
 # Create a new directory with the same base name but "_filtered" appended
 FILTERED_DIR="$PARENT_DIR/${BASE_NAME}_filtered"
 mkdir -p "$FILTERED_DIR"
-
-# Copy files listed in subset.txt from the problem path to the new directory
-while IFS= read -r line; do
-    # Use sed to trim leading and trailing whitespace
-    file=$(echo "$line" | sed 's/^[[:space:]]*//;s/[[:space:]]*$//')
-
-    # Check if the file exists before copying
-    if [ -f "$PROBLEM_PATH/$file" ]; then
-        cp "$PROBLEM_PATH/$file" "$FILTERED_DIR/"
-    else
-        echo "Warning: File $PROBLEM_PATH/$file does not exist."
-    fi
-done < "$SUBSET_PATH"
-
-echo "Done copying files to $FILTERED_DIR."
+FILTERED_DIR=$(cd "$FILTERED_DIR" && pwd)
+PROBLEM_DIR=$(cd "$PROBLEM_PATH" && pwd)
+
+# Trim whitespace from every line of subset.txt at once, drop blank lines and comments,
+# and link the files that exist (symlinks need absolute targets) with as few ln calls as possible.
+sed 's/^[[:space:]]*//;s/[[:space:]]*$//' "$SUBSET_PATH" | grep -v -e '^$' -e '^#' | (
+    cd "$PROBLEM_DIR" || exit 1
+    while IFS= read -r file; do
+        if [ -f "$file" ]; then
+            printf '%s\0' "$PROBLEM_DIR/$file"
+        else
+            echo "Warning: File $PROBLEM_PATH/$file does not exist." >&2
+        fi
+    done | xargs -0 -r ln $LINK_FLAGS -t "$FILTERED_DIR"
+)
+
+echo "Done linking files into $FILTERED_DIR."
@@ -1,133 +1,812 @@
-import os, re, subprocess, pickle, math
+import os, io, re, signal, subprocess, selectors, pickle, math, hashlib, threading, time, json, fcntl
 from glob import glob
-from collections import defaultdict, Counter
+from collections import defaultdict, Counter, deque
+from dataclasses import dataclass, field
+from typing import Optional
 
-def runE(args, masterStratPath):
-    executable = "eprover-ho" if args.higherOrder else "eprover"
-    executable = f"./eprover/PROVER/{executable}"
-    
-    if masterStratPath is not None:
-        eArgs = f"{args.eArgs} --parse-strategy={masterStratPath}"
-    else:
-        eArgs = args.eArgs
-    command = f"{executable} {eArgs} {args.problem}"
+from stratClient import waitWithUsage, tracePath, tracePhase, parseStratLines, eproverVersion, atomicWrite, requestDaemon
 
-    # print(f"Running command: '{command}'")
-    subprocess.run(command, shell=True)
+def getStratPathsFromFiles(problem, dataDir, newStrat, topK=0, record=True):
+    # The rest of getStratPaths when no daemon serves dataDir: record newStrat
+    # in the history on disk and merge the master strategy in this process.
+    with tracePhase(dataDir, "lock", problem):
+        lock = obtainLock(dataDirLockPath(dataDir)) if record else None
+    if lock is not None:
+        with tracePhase(dataDir, "append", problem):
+            appendStratHistory(dataDir, newStrat)
+        releaseLock(lock)
+    elif record:
+        print("Timed out waiting for the data dir lock; not recording this strategy")
+    with _histCacheLock: # The cached history is shared by every thread in this process.
+        with tracePhase(dataDir, "load", problem):
+            stratHist = loadStratHistory(dataDir)
+        with tracePhase(dataDir, "merge", problem):
+            masterStratPath = clusterMasterPath(stratHist, dataDir, newStrat) or makeMasterFromHistory(stratHist, dataDir)
+            stratPaths = [masterStratPath] + writeTopStrats(stratHist, dataDir, topK)
 
+    if stratLogNeedsCompaction(dataDir):
+        compactStratHistoryInBackground(dataDir)
+    return list(dict.fromkeys(stratPaths))
 
 
-def getProbStrat(problem, dataDir, higherOrder):
-    probName = os.path.split(problem)[1]
-    executable = "eprover-ho" if higherOrder else "eprover"
-    executable = f"./eprover/PROVER/{executable}"
-    
-    eArgs = f"--auto --print-strategy --cpu-limit=120"
-    os.makedirs(f"{dataDir}/tmp", exist_ok=True)
-    with open(f"{dataDir}/tmp/{probName}", "w") as f:
-        subprocess.run(f"{executable} {eArgs} {problem}", shell=True, stdout=f)
+def cpuLimitOf(eArgs):
+    # E's hard cpu limit in eArgs (or its soft one, if that's all there is), in seconds.
+    for option in ["--cpu-limit", "--soft-cpu-limit"]:
+        m = re.search(rf"{option}=(\d+)", eArgs)
+        if m is not None:
+            return int(m.group(1))
+    return None
+
+def splitCpuLimit(eArgs, share):
+    # Scale E's (soft) cpu limits by share, for when several E processes split one budget.
+    if share >= 1:
+        return eArgs
+    scale = lambda m: f"{m.group(1)}={max(1, math.floor(int(m.group(2)) * share))}"
+    return re.sub(r"(--(?:soft-)?cpu-limit)=(\d+)", scale, eArgs)
+
+def raceE(commands, keepOutput=True, onStart=None, beforeReap=None):
+    # Run the E commands concurrently, parsing each one's output as it arrives.
+    # As soon as one of them reports a proof the others are killed, and the
+    # winner is left to print the rest of it. Output is only kept if keepOutput.
+    # onStart gets the launched processes (e.g. to register them for cancellation),
+    # and beforeReap runs once they have all exited (see waitWithUsage).
+    # Returns (index of the winner or None, stdout of each, EResult of each, rusage of each).
+    procs = [subprocess.Popen(c, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) for c in commands]
+    if onStart is not None:
+        onStart(procs)
+
+    parsers = [EOutputParser() for _ in procs]
+    outputs = [bytearray() for _ in procs]
+    partialLines = [b"" for _ in procs]
+    winner = None
+    with selectors.DefaultSelector() as sel:
+        for i, p in enumerate(procs):
+            sel.register(p.stdout, selectors.EVENT_READ, i)
+
+        while len(sel.get_map()) > 0:
+            for key, _ in sel.select():
+                i = key.data
+                chunk = os.read(key.fd, 1 << 16)
+                if not chunk:
+                    sel.unregister(key.fileobj)
+                    parsers[i].feed(partialLines[i].decode("utf-8", errors="replace"))
+                    continue
+
+                if keepOutput:
+                    outputs[i] += chunk
+                lines = (partialLines[i] + chunk).split(b"\n")
+                partialLines[i] = lines.pop()
+                for line in lines:
+                    parsers[i].feed(line.decode("utf-8", errors="replace"))
+
+                if winner is None and parsers[i].result.proved:
+                    winner = i
+                    for j, p in enumerate(procs):
+                        if j != winner and p.stdout in sel.get_map():
+                            sel.unregister(p.stdout)
+                            # Not p.kill(): it polls first, which would reap an exited p before waitWithUsage does.
+                            try:
+                                os.kill(p.pid, signal.SIGKILL)
+                            except ProcessLookupError:
+                                pass
+
+    for p in procs:
+        p.stdout.close()
+        os.waitid(os.P_PID, p.pid, os.WEXITED | os.WNOWAIT)
+    if beforeReap is not None:
+        beforeReap()
+    usages = [waitWithUsage(p) for p in procs]
+    return winner, [bytes(o) for o in outputs], [parser.result for parser in parsers], usages
+
+
+
+def traceSummary(dataDir):
+    # {phase: {"count": n, **summarizeValues(seconds)}}
+    seconds = defaultdict(list)
+    with open(tracePath(dataDir)) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            seconds[entry["phase"]].append(entry["seconds"])
+    return {phase: {"count": len(v), **summarizeValues(sorted(v))} for phase, v in seconds.items()}
+
+
+
+
+
+###### Parsing E's output ###################################
+# E's output is parsed a line at a time while E runs, keeping only the SZS
+# status and the "# Name : value" statistics, so memory doesn't grow with the
+# size of the proof (or of -l2 output). Lines inside the proof are skipped.
+
+SOLVED_STATUSES = {"Theorem", "Unsatisfiable"}
+
+@dataclass
+class EResult:
+    status: Optional[str] = None
+    processedClauses: Optional[int] = None
+    generatedClauses: Optional[int] = None
+    removedClauses: Optional[int] = None    # sum of every "Removed ..." statistic
+    userTime: Optional[float] = None        # seconds
+    systemTime: Optional[float] = None      # seconds
+    maxResidentSetSize: Optional[int] = None # pages, as E reports it
+    stats: dict = field(default_factory=dict) # every statistic, by E's name for it
+
+    @property
+    def proved(self):
+        return self.status in SOLVED_STATUSES
+
+E_STAT_FIELDS = {
+    "Processed clauses": "processedClauses",
+    "Generated clauses": "generatedClauses",
+    "User time": "userTime",
+    "System time": "systemTime",
+    "Maximum resident set size": "maxResidentSetSize",
+}
+
+class EOutputParser:
+    def __init__(self):
+        self.result = EResult()
+        self.inProof = False
+
+    def feed(self, line):
+        if not line.startswith("#"):
+            return
+        if self.inProof:
+            self.inProof = not line.startswith("# SZS output end")
+        elif line.startswith("# SZS status "):
+            self.result.status = line.split()[3]
+        elif line.startswith("# SZS output start"):
+            self.inProof = True
+        elif ":" in line:
+            name, value = line[1:].split(":", 1)
+            self.stat(name.strip(), value.split())
+
+    def stat(self, name, valueWords):
+        if len(valueWords) == 0:
+            return
+        try:
+            value = int(valueWords[0])
+        except ValueError:
+            try:
+                value = float(valueWords[0])
+            except ValueError:
+                return
+
+        self.result.stats[name] = value
+        if name in E_STAT_FIELDS:
+            setattr(self.result, E_STAT_FIELDS[name], value)
+        elif name.startswith("Removed"):
+            self.result.removedClauses = (self.result.removedClauses or 0) + value
+
+def parseEOutput(lines):
+    parser = EOutputParser()
+    for line in lines:
+        parser.feed(line)
+    return parser.result
+
+
+
+
+
+###### Problem sets #########################################
+# A subset of a problem directory is a manifest: a text file naming one
+# problem per line, relative to the directory (or absolute), with blank lines
+# and #-comments ignored. The experiment scripts read it directly, so subsets
+# never have to be copied out of the corpus.
+
+def readManifest(manifest):
+    with open(manifest) as f:
+        names = [line.strip() for line in f]
+    return [name for name in names if name and not name.startswith("#")]
+
+def listProblems(problemsPath, manifest=None):
+    # The .p files in problemsPath, or just those listed in manifest, sorted.
+    if manifest is None:
+        return sorted(glob(f"{problemsPath}/*.p"))
+
+    present = {e.name for e in os.scandir(problemsPath)} # One directory scan rather than a stat per problem.
+    problems, missing = [], 0
+    for name in readManifest(manifest):
+        if os.path.isabs(name) or os.sep in name:
+            path = name if os.path.isabs(name) else os.path.join(problemsPath, name)
+            exists = os.path.exists(path)
+        else:
+            path = os.path.join(problemsPath, name)
+            exists = name in present
+        if exists:
+            problems.append(path)
+        else:
+            missing += 1
+    if missing > 0:
+        print(f"Warning: {missing} problems in {manifest} do not exist in {problemsPath}")
+    return sorted(set(problems))
 
-    return parseStrat(f"{dataDir}/tmp/{probName}")
+
+
+
+
+###### Proof attempt cache ##################################
+# Opt-in memo of whole proof attempts for the experiment runner, under
+# $dataDir/attempt_cache. An entry is keyed by the E command with everything
+# that names a file replaced by a hash of what is in it: the executable by E's
+# version, each --parse-strategy file by its canonical serialization and the
+# problem by its text. So byte-identical problems share entries, and so do
+# reruns with an unchanged strategy, whatever the files are called.
+
+_stratTextHashes = {} # (path, mtime_ns, size) -> hash of the strategy's canonical serialization
+
+def attemptCacheDir(dataDir):
+    return f"{dataDir}/attempt_cache"
+
+def fileHash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        h.update(f.read())
+    return h.hexdigest()
+
+def stratTextHash(stratPath):
+    st = os.stat(stratPath)
+    statKey = (os.path.abspath(stratPath), st.st_mtime_ns, st.st_size)
+    if statKey not in _stratTextHashes:
+        # Parsing and re-serializing ignores comments, spacing and CEF order.
+        text = serializeStrat(parseStrat(stratPath))
+        _stratTextHashes[statKey] = hashlib.sha256(text.encode()).hexdigest()
+    return _stratTextHashes[statKey]
+
+def attemptCacheKey(commands, dataDir):
+    # commands are eCommand argument vectors (several for a portfolio).
+    h = hashlib.sha256()
+    for command in commands:
+        executable, *eArgs, problem = command
+        options = [] # Each option with the values that follow it, so their order can be normalized.
+        for arg in eArgs:
+            if arg.startswith("--parse-strategy="):
+                arg = "--parse-strategy=" + stratTextHash(arg.split("=", 1)[1])
+            if arg.startswith("-") or len(options) == 0:
+                options.append(arg)
+            else:
+                options[-1] += " " + arg
+        parts = [eproverVersion(executable, dataDir), *sorted(options), fileHash(problem)]
+        h.update("\0".join(parts).encode() + b"\n")
+    return h.hexdigest()
+
+def readAttemptCache(dataDir, cacheKey):
+    try:
+        with open(f"{attemptCacheDir(dataDir)}/{cacheKey}.json") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+def writeAttemptCache(dataDir, cacheKey, entry):
+    os.makedirs(attemptCacheDir(dataDir), exist_ok=True)
+    atomicWrite(f"{attemptCacheDir(dataDir)}/{cacheKey}.json", json.dumps(entry).encode())
 
 
 
 
 
 ###### File Locking #########################################
+# The data dir is guarded by flock on $dataDir/lockfile: exclusive for
+# writers, shared for readers, and released by the kernel if the holder dies.
+# Where flock isn't supported we fall back to creating the file with O_EXCL,
+# and treat it as stale if the PID written into it is no longer running.
+# Every acquisition appends its wait and hold times to lockfile.stats, which
+# is moved to lockfile.stats.1 (replacing the one before) once it passes
+# LOCK_STATS_MAX_BYTES, so at most the latest two files' worth are kept.
+
+LOCK_TIMEOUT = float(os.environ.get("SLH_LOCK_TIMEOUT", 60))
+LOCK_STATS_MAX_BYTES = int(os.environ.get("SLH_LOCK_STATS_MAX_BYTES", 1 << 20))
+
+class LockHandle:
+    def __init__(self, path, fd, shared, waited):
+        self.path = path
+        self.fd = fd
+        self.shared = shared
+        self.waited = waited
+        self.acquiredAt = time.monotonic()
+
+def dataDirLockPath(dataDir):
+    return f"{dataDir}/lockfile"
 
-def obtainLock(lock_path):
+def obtainLock(lock_path, shared=False, timeout=None):
+    # Blocks until the lock is held and returns a handle for releaseLock,
+    # or returns None if that takes longer than timeout seconds.
+    timeout = LOCK_TIMEOUT if timeout is None else timeout
+    start = time.monotonic()
+    delay = 0.001
+    while True:
+        fd = _tryLock(lock_path, shared)
+        waited = time.monotonic() - start
+        if fd is not None:
+            return LockHandle(lock_path, fd, shared, waited)
+        if waited > timeout:
+            _recordLockStats(lock_path, shared, waited, None)
+            return None
+        time.sleep(delay)
+        delay = min(2 * delay, 0.05)
+
+def _tryLock(lock_path, shared):
+    fd = os.open(lock_path, os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        fcntl.flock(fd, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    except OSError:
+        os.close(fd)
+        return _tryExclusiveFileLock(lock_path)
+
+    if not shared:
+        # Write the current process PID to the lock file for reference
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, str(os.getpid()).encode(), 0)
+    return fd
+
+def _tryExclusiveFileLock(lock_path):
+    # Shared locks are taken exclusively here; this path is only for
+    # filesystems without flock, where correctness beats concurrency.
+    lockFilePath = f"{lock_path}.excl"
     try:
         # os.O_CREAT - Create file if it does not exist.
         # os.O_EXCL - Ensure atomic creation of the file.
-        fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_RDWR)
-        # Write the current process PID to the lock file for reference
-        os.write(fd, str(os.getpid()).encode())
-        os.close(fd)
-        return True
-    
+        fd = os.open(lockFilePath, os.O_CREAT | os.O_EXCL | os.O_RDWR, 0o644)
     except FileExistsError:
-        return False
+        if _lockHolderIsDead(lockFilePath):
+            _removeStaleLock(lockFilePath)
+        return None
 
+    os.write(fd, str(os.getpid()).encode())
+    return -fd - 1 # Negative fds mark a file lock, so releaseLock knows to remove it.
 
-def releaseLock(lock_path):
+def _removeStaleLock(lockFilePath):
+    # Another waiter may have seen the same dead holder, removed its file and
+    # taken the lock already. So the file is moved aside (only one waiter can)
+    # and checked again before it is deleted, and put back if it is a live lock.
+    asidePath = f"{lockFilePath}.stale.{os.getpid()}.{threading.get_ident()}"
     try:
-        os.remove(lock_path)
+        os.rename(lockFilePath, asidePath)
     except OSError:
-        print("Error releasing lock!")
+        return
+    if not _lockHolderIsDead(asidePath):
+        try:
+            os.link(asidePath, lockFilePath) # Fails rather than replace a lock taken in the meantime.
+        except OSError:
+            pass
+    os.remove(asidePath)
 
+def _lockHolderIsDead(lockFilePath):
+    try:
+        with open(lockFilePath) as f:
+            pid = int(f.read().strip())
+    except (OSError, ValueError):
+        return False # Gone already, or the holder hasn't written its PID yet.
 
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
 
+def releaseLock(lock):
+    if lock is None:
+        return
 
+    held = time.monotonic() - lock.acquiredAt
+    try:
+        if lock.fd < 0:
+            os.close(-lock.fd - 1)
+            os.remove(f"{lock.path}.excl")
+        else:
+            fcntl.flock(lock.fd, fcntl.LOCK_UN)
+            os.close(lock.fd)
+    except OSError:
+        print("Error releasing lock!")
+    _recordLockStats(lock.path, lock.shared, lock.waited, held)
 
-######## Actual Strategy merging ###########################
+def _recordLockStats(lock_path, shared, waited, held):
+    record = {"time": time.time(), "pid": os.getpid(), "mode": "shared" if shared else "exclusive",
+              "wait": waited, "hold": held, "timedOut": held is None}
+    try:
+        with open(f"{lock_path}.stats", "a") as f:
+            f.write(json.dumps(record) + "\n")
+            full = f.tell() > LOCK_STATS_MAX_BYTES
+        if full:
+            os.replace(f"{lock_path}.stats", f"{lock_path}.stats.1")
+    except OSError:
+        pass
 
-def parseStrat(stratFile):
-    def parseKeyVal(k,v):
-        if v == "true":
-            return True
-        elif v == "false":
-            return False
-        elif v.startswith('"') and v.endswith('"'):
-            return v[1:-1]
-        else:
-            try:
-                return int(v)
-            except:
-                try:
-                    return float(v)
-                except:
-                    return v
-                
-    def fixHeuristicDef(strat):
-        if "heuristic_def" in strat:
-            strat["heuristic_def"] = re.findall(r"([0-9]+)[.*](\w+\([^\)]*\))", strat["heuristic_def"])
-            strat["heuristic_def"] = tuple(sorted([(int(w),f) for w,f in strat["heuristic_def"]]))
+def lockStats(lock_path):
+    # Summarize lockfile.stats (and the rotated lockfile.stats.1): counts plus wait/hold time percentiles (seconds).
+    records = []
+    for path in [f"{lock_path}.stats.1", f"{lock_path}.stats"]:
+        try:
+            with open(path) as f:
+                records += [json.loads(l) for l in f if l.strip()]
+        except FileNotFoundError:
+            pass
 
+    summary = {"acquisitions": sum(1 for r in records if not r["timedOut"]),
+               "timeouts": sum(1 for r in records if r["timedOut"])}
+    for field in ["wait", "hold"]:
+        values = sorted(r[field] for r in records if r[field] is not None)
+        summary[field] = summarizeValues(values)
+    return summary
 
-    with open(stratFile) as f:
-        lines = f.readlines()
-        lines = [l for l in lines if not l.startswith("#") and len(l.strip()) > 1 and ":" in l]
+def summarizeValues(values):
+    # Mean and percentiles of an already sorted list.
+    if len(values) == 0:
+        return {}
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {"mean": sum(values) / len(values), "p50": pick(0.5), "p90": pick(0.9), "p95": pick(0.95),
+            "p99": pick(0.99), "max": values[-1]}
 
-    strat = {k.strip():v.strip() for k,v in [l.split(":") for l in lines]}
-    assert len(strat) == len(lines) # There should be no duplicate keys.
 
-    for k,v in strat.items():
-        strat[k] = parseKeyVal(k,v)
-    
-    fixHeuristicDef(strat)
 
-    return strat
+
+
+######## Actual Strategy merging ###########################
+
+def parseStrat(stratFile):
+    with open(stratFile) as f:
+        return parseStratLines(f.readlines())
 
 def loadStratHistory(dataDir):
-    stratHist = defaultdict(Counter)
-    stratHistPath = f"{dataDir}/strat_history.pkl"
-    if os.path.exists(stratHistPath):
-        with open(stratHistPath, "rb") as f:
-            stratHist = pickle.load(f)
-            
-    return stratHist
+    # The history is the snapshot in strat_history.pkl folded with every record
+    # appended to strat_history.log after the snapshot was taken. The result is
+    # cached per process and only the new tail of the log is read on later calls,
+    # so the returned history is shared: update it through appendStratHistory.
+    with _histCacheLock:
+        logId = _stratLogId(dataDir)
+        cached = _histCache.get(dataDir)
+        if cached is None or cached[0] != logId or cached[1] > _stratLogSize(dataDir):
+            hist, offset = loadStratSnapshot(dataDir)
+        else:
+            _, offset, hist = cached
+
+        offset = foldStratLog(hist, dataDir, offset)
+        _histCache[dataDir] = (logId, offset, hist)
+        return hist
 
 def updateStratHistory(hist, newStrat):
-    for k,v in newStrat.items():
-        hist[k][v] += 1
+    if hasattr(hist, "add"): # A StratHistory, or a stratVectors.StratCounts
+        hist.add(newStrat)
+    else:
+        for k,v in newStrat.items():
+            hist[k][v] += 1
 
     return hist
 
-def saveStratHistory(hist, dataDir):
-    stratHistPath = f"{dataDir}/strat_history.pkl"
-    with open(stratHistPath, "wb") as f:
-        pickle.dump(hist, f)
+def saveStratHistory(hist, dataDir, logOffset=0):
+    # Snapshots are written atomically and record how much of the log they
+    # contain, so readers never see a half-written file and can't double count.
+    # The history's config is kept next to the offset, so it too can be checked
+    # without loading the history (see stratLogNeedsCompaction).
+    atomicWrite(stratSnapshotPath(dataDir), pickle.dumps((logOffset, hist.config())) + pickle.dumps(hist))
 
 def makeMasterFromHistory(hist, dataDir, toFile=True):
-    masterStratPath = f"{dataDir}/MASTER.{os.getpid()}.strat"
-    master = makeMasterStrat(hist, all_ones=False)
+    if hasattr(hist, "master"):
+        master = hist.master()
+    else:
+        master = makeMasterStrat(hist, all_ones=False)
+
     if toFile:
-        with open(masterStratPath, "w") as f:
-            f.write(serializeStrat(master))
-        return masterStratPath
+        return writeMasterStrat(master, dataDir)
     else:
         return master
 
+def writeMasterStrat(master, dataDir, prefix="MASTER"):
+    # Master files are named after their content, so every call whose merge
+    # result is unchanged reuses the same file instead of writing a new one.
+    # A reused file is touched, so removeStaleStratFiles sees it is still in use.
+    text = serializeStrat(dict(master))
+    masterStratPath = f"{dataDir}/{prefix}.{hashlib.sha1(text.encode()).hexdigest()[:16]}.strat"
+    try:
+        os.utime(masterStratPath)
+    except FileNotFoundError:
+        atomicWrite(masterStratPath, text.encode())
+    return masterStratPath
+
+def writeTopStrats(hist, dataDir, k):
+    return [writeMasterStrat(strat, dataDir, prefix="TOP") for strat in hist.topStrats(k)]
+
+
+
+
+
+
+######## Strategy history journal ################################
+# Rather than rewriting the whole pickled history for every problem, each
+# update is a small record appended to strat_history.log. The log is never
+# rewritten; strat_history.pkl is just a snapshot of the log up to some offset,
+# refreshed in the background once the unsnapshotted tail grows past
+# STRAT_LOG_COMPACT_BYTES. Deleting both files resets all learning.
+# Compaction doesn't shorten the log: it is the only complete record of the
+# history, from which a different SLH_STRAT_HALF_LIFE or SLH_STRAT_WINDOW
+# rebuilds it, and processes keep offsets into it. So it grows by several hundred
+# bytes per problem, until pruneStratLog is run while the data dir is idle.
+# Compaction also deletes the MASTER/TOP/CLUSTER files no call has been given
+# for STRAT_FILE_MAX_AGE seconds, since every change of the merge result
+# (which decay or a window makes frequent) leaves a file behind.
+
+STRAT_LOG_COMPACT_BYTES = int(os.environ.get("SLH_STRAT_LOG_COMPACT_BYTES", 1 << 20))
+STRAT_FILE_MAX_AGE = float(os.environ.get("SLH_STRAT_FILE_MAX_AGE", 3600))
+_histCache = {} # dataDir -> (logId, logOffset, hist)
+_histCacheLock = threading.RLock()
+
+def stratSnapshotPath(dataDir):
+    return f"{dataDir}/strat_history.pkl"
+
+def stratLogPath(dataDir):
+    return f"{dataDir}/strat_history.log"
+
+def _stratLogId(dataDir):
+    try:
+        st = os.stat(stratLogPath(dataDir))
+        return (st.st_dev, st.st_ino)
+    except FileNotFoundError:
+        return None
+
+def _stratLogSize(dataDir):
+    try:
+        return os.path.getsize(stratLogPath(dataDir))
+    except FileNotFoundError:
+        return 0
+
+def _stratSnapshotHeader(dataDir):
+    # (offset, config) of the snapshot, pickled ahead of the history so they can be
+    # read on their own. The config is None for snapshots from before it was kept.
+    try:
+        with open(stratSnapshotPath(dataDir), "rb") as f:
+            header = pickle.load(f)
+    except FileNotFoundError:
+        return 0, stratHistoryConfig()
+    if isinstance(header, tuple):
+        return header
+    return (header if isinstance(header, int) else 0), None
+
+def stratHistoryConfig():
+    # How the history weighs older problems (see StratHistory), from the environment.
+    halfLife = os.environ.get("SLH_STRAT_HALF_LIFE")
+    window = os.environ.get("SLH_STRAT_WINDOW")
+    return {"halfLife": float(halfLife) if halfLife else None, "window": int(window) if window else None}
+
+def loadStratSnapshot(dataDir):
+    # If the snapshot was taken with a different stratHistoryConfig, start from
+    # an empty history instead: folding in the whole log then rebuilds it.
+    config = stratHistoryConfig()
+    if not os.path.exists(stratSnapshotPath(dataDir)):
+        return StratHistory(**config), 0
+
+    with open(stratSnapshotPath(dataDir), "rb") as f:
+        offset = pickle.load(f)
+        if isinstance(offset, tuple):
+            offset, _ = offset
+        elif not isinstance(offset, int):
+            # A whole-history pickle from before the journal existed.
+            if config == StratHistory().config():
+                return StratHistory.fromCounters(offset), 0
+            return StratHistory(**config), 0
+        hist = pickle.load(f)
+    if hist.config() != config:
+        return StratHistory(**config), 0
+    return hist, offset
+
+def appendStratHistory(dataDir, *newStrats):
+    # A single O_APPEND write of a few small records, so its cost (and the time
+    # the caller holds the data dir lock) doesn't depend on the history size.
+    record = b"".join(pickle.dumps({"pid": os.getpid(), "strat": strat}) for strat in newStrats)
+    fd = os.open(stratLogPath(dataDir), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, record)
+    finally:
+        os.close(fd)
+
+def foldStratLog(hist, dataDir, offset, skipPid=None):
+    # Apply every complete record after offset to hist and return the offset
+    # just past the last one. A record still being written is left for later.
+    # Records appended by skipPid are passed over (the daemon already has its own).
+    # Writers append under the exclusive lock, so a shared lock while reading
+    # the tail means we never see a torn record, even where appends aren't atomic.
+    lock = obtainLock(dataDirLockPath(dataDir), shared=True)
+    try:
+        with open(stratLogPath(dataDir), "rb") as f:
+            f.seek(offset)
+            tail = f.read()
+    except FileNotFoundError:
+        return offset
+    finally:
+        releaseLock(lock)
+
+    return offset + _foldStratRecords(hist, tail, skipPid)
+
+def _foldStratRecords(hist, tail, skipPid=None):
+    # Returns how many bytes of tail were complete records.
+    buf = io.BytesIO(tail)
+    consumed = 0
+    while consumed < len(tail):
+        try:
+            record = pickle.load(buf)
+        except (EOFError, pickle.UnpicklingError):
+            break
+        if record["pid"] != skipPid:
+            updateStratHistory(hist, record["strat"])
+        consumed = buf.tell()
+    return consumed
+
+def pruneStratLog(dataDir):
+    # Folds the whole log into the snapshot and starts a new, empty log. Afterwards
+    # a config change can only rebuild the history from the records appended since.
+    # Nothing may use the data dir meanwhile: wrappers, experiments and especially
+    # the daemon keep offsets into the log they have read.
+    if requestDaemon(dataDir, {"op": "master"}) is not None:
+        raise RuntimeError(f"Stop the strategy daemon serving {dataDir} before pruning its log")
+    lock = obtainLock(dataDirLockPath(dataDir))
+    if lock is None:
+        raise TimeoutError(f"Timed out waiting for the lock of {dataDir}")
+    try:
+        hist, offset = loadStratSnapshot(dataDir)
+        try:
+            with open(stratLogPath(dataDir), "rb") as f:
+                f.seek(offset)
+                tail = f.read()
+        except FileNotFoundError:
+            tail = b""
+        consumed = _foldStratRecords(hist, tail)
+        saveStratHistory(hist, dataDir, 0)
+        atomicWrite(stratLogPath(dataDir), tail[consumed:])
+    finally:
+        releaseLock(lock)
+
+def stratLogNeedsCompaction(dataDir, threshold=None):
+    # Also when the snapshot was taken with another config: until it is redone,
+    # every load would rebuild the history from the whole log (see loadStratSnapshot).
+    threshold = STRAT_LOG_COMPACT_BYTES if threshold is None else threshold
+    offset, config = _stratSnapshotHeader(dataDir)
+    return config != stratHistoryConfig() or _stratLogSize(dataDir) - offset > threshold
+
+def compactStratHistory(dataDir):
+    with tracePhase(dataDir, "compact"):
+        hist, offset = loadStratSnapshot(dataDir)
+        offset = foldStratLog(hist, dataDir, offset)
+        saveStratHistory(hist, dataDir, offset)
+        clusters = loadStratClusters(dataDir)
+        removeStaleStratFiles(dataDir, [makeMasterFromHistory(hist, dataDir)] + ([] if clusters is None else clusters["paths"]))
+    return offset
+
+def removeStaleStratFiles(dataDir, keep=(), maxAge=None):
+    # Superseded strategy files, going by mtime (see writeMasterStrat). Ones an E
+    # process was just given are recent, so they aren't pulled out from under it.
+    maxAge = STRAT_FILE_MAX_AGE if maxAge is None else maxAge
+    cutoff = time.time() - maxAge
+    keep = {os.path.basename(path) for path in keep}
+    for e in os.scandir(dataDir):
+        if e.name.split(".")[0] not in ("MASTER", "TOP", "CLUSTER") or not e.name.endswith(".strat") or e.name in keep:
+            continue
+        try:
+            if e.stat().st_mtime < cutoff:
+                os.remove(e.path)
+        except OSError:
+            pass
+
+def compactStratHistoryInBackground(dataDir):
+    t = threading.Thread(target=compactStratHistory, args=(dataDir,))
+    t.start()
+    return t
+
+
+
+
+
+######## Clustered master strategies ##############################
+# One master strategy fits a mix of problem families badly. With
+# SLH_STRAT_CLUSTERS=k the distinct strategies in the history are clustered
+# (k-modes: a strategy's distance to a cluster is the number of keys on which
+# it differs from the cluster's per-key most common values), and each cluster
+# gets its own CLUSTER.<hash>.strat master. A problem then gets the master of
+# the cluster closest to its own probed strategy, which E's --auto derived
+# from the problem's features anyway.
+# Clustering is redone once SLH_STRAT_RECLUSTER_EVERY problems were added
+# since the last time, and its result is kept in strat_clusters.pkl, so
+# picking a cluster usually costs one stat and k distance computations.
+
+STRAT_CLUSTERS = int(os.environ.get("SLH_STRAT_CLUSTERS", 0))
+STRAT_RECLUSTER_EVERY = int(os.environ.get("SLH_STRAT_RECLUSTER_EVERY", 100))
+_clusterCache = {} # dataDir -> (mtime_ns of strat_clusters.pkl, clusters)
+
+def stratClustersPath(dataDir):
+    return f"{dataDir}/strat_clusters.pkl"
+
+def stratDistance(strat, centroid):
+    return sum(1 for k in centroid.keys() | strat.keys() if strat.get(k) != centroid.get(k))
+
+def modeStrat(weightedStrats):
+    # The most common value of every key over (strat, weight) pairs.
+    summary = defaultdict(Counter)
+    for strat, weight in weightedStrats:
+        for k, v in strat.items():
+            summary[k][v] += weight
+    return {k: counter.most_common(1)[0][0] for k, counter in summary.items()}
+
+def clusterStrats(weightedStrats, k, maxIterations=20):
+    # Weighted k-modes over (strat, weight) pairs. Returns the centroids and
+    # the index of the cluster each strategy was assigned to. Deterministic:
+    # the first centroid is the heaviest strategy, and every next one the
+    # strategy furthest from the centroids chosen so far.
+    k = min(k, len(weightedStrats))
+    if k == 0:
+        return [], []
+    centroids = [max(weightedStrats, key=lambda sw: sw[1])[0]]
+    nearest = [stratDistance(s, centroids[0]) for s, _ in weightedStrats]
+    while len(centroids) < k:
+        i = max(range(len(weightedStrats)), key=lambda i: nearest[i] * weightedStrats[i][1])
+        if nearest[i] == 0:
+            break # Fewer distinct strategies than clusters.
+        centroids.append(weightedStrats[i][0])
+        nearest = [min(d, stratDistance(s, centroids[-1])) for d, (s, _) in zip(nearest, weightedStrats)]
+
+    assignments = None
+    for _ in range(maxIterations):
+        newAssignments = [nearestCluster(s, centroids) for s, _ in weightedStrats]
+        if newAssignments == assignments:
+            break
+        assignments = newAssignments
+        members = defaultdict(list)
+        for sw, c in zip(weightedStrats, assignments):
+            members[c].append(sw)
+        centroids = [modeStrat(members[c]) if c in members else centroid for c, centroid in enumerate(centroids)]
+    return centroids, assignments
+
+def nearestCluster(strat, centroids):
+    return min(range(len(centroids)), key=lambda c: stratDistance(strat, centroids[c]))
+
+def makeClusterMasters(hist, dataDir, k):
+    # Cluster the history's strategies, write each cluster's master and save
+    # the centroids with the master paths to strat_clusters.pkl.
+    weightedStrats = [(dict(items), weight) for items, weight in hist.fullStrats.items()]
+    centroids, assignments = clusterStrats(weightedStrats, k)
+
+    members = [StratHistory() for _ in centroids]
+    for (strat, weight), c in zip(weightedStrats, assignments):
+        members[c].add(strat, weight)
+    clusters = {
+        "k": k,
+        "added": hist.added,
+        "centroids": centroids,
+        "paths": [writeMasterStrat(m.master(), dataDir, prefix="CLUSTER") for m in members],
+    }
+    atomicWrite(stratClustersPath(dataDir), pickle.dumps(clusters))
+    return clusters
+
+def loadStratClusters(dataDir):
+    try:
+        mtime = os.stat(stratClustersPath(dataDir)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    cached = _clusterCache.get(dataDir)
+    if cached is None or cached[0] != mtime:
+        with open(stratClustersPath(dataDir), "rb") as f:
+            cached = (mtime, pickle.load(f))
+        _clusterCache[dataDir] = cached
+    return cached[1]
+
+def clusterMasterPath(hist, dataDir, strat, k=None):
+    # The path of the master of strat's cluster, or None if clustering is off
+    # (or there is no history to cluster yet).
+    k = STRAT_CLUSTERS if k is None else k
+    if k <= 1 or strat is None:
+        return None
+    clusters = loadStratClusters(dataDir)
+    if clusters is None or clusters["k"] != k or hist.added - clusters["added"] >= STRAT_RECLUSTER_EVERY \
+            or hist.added < clusters["added"]:
+        clusters = makeClusterMasters(hist, dataDir, k)
+    if len(clusters["centroids"]) == 0:
+        return None
+    return clusters["paths"][nearestCluster(strat, clusters["centroids"])]
 
 
 
@@ -136,14 +815,18 @@ def makeMasterFromHistory(hist, dataDir, toFile=True):
 ######## Implementation of strategy merging ######################
 
 def makeMasterHeuristic(counter: Counter, all_ones: bool):
-    maxCEFWeight = 20
-
     master = defaultdict(lambda:0)
     for CEFs, probCount in counter.items():
         for weight, CEF in CEFs:
             master[CEF] += weight * probCount
 
+    return scaleHeuristicWeights(master, all_ones)
+
+def scaleHeuristicWeights(cefWeights, all_ones: bool):
+    maxCEFWeight = 20
+
     # Scale the weights so that the max weight is maxCEFWeight.
+    master = dict(cefWeights)
     scalingFactor = maxCEFWeight / max(master.values())
     for k,v in master.items():
         master[k] = math.ceil(v*scalingFactor)
@@ -158,6 +841,8 @@ def makeMasterHeuristic(counter: Counter, all_ones: bool):
 def makeMasterStrat(summary, all_ones, instead=None, keepCommon="heuristic"):
     # Make a master strategy that is the most common value for each key, except for heuristic_def
     # where we call makeMasterHeuristic.
+    if hasattr(summary, "master") and instead is None:
+        return summary.master(all_ones) # It keeps its own counts (StratHistory, stratVectors.StratCounts).
     master = {}
     
     assert keepCommon in ["heuristic", "else"]
@@ -182,6 +867,139 @@ def makeMasterStrat(summary, all_ones, instead=None, keepCommon="heuristic"):
 
 
 
+class StratHistory(defaultdict):
+    # A defaultdict(Counter) of how often each value was seen for each strategy
+    # key, which also keeps the inputs of makeMasterStrat up to date as counts
+    # change: the most common value of every key, and the weighted CEF sums that
+    # makeMasterHeuristic would otherwise recompute over every heuristic_def.
+    # master() therefore costs O(keys + CEFs) no matter how long the history is.
+    #
+    # Older problems can be made to count for less, so the master follows what
+    # the current session sees:
+    # - halfLife=h: each problem weighs 2**(1/h) times as much as the one before,
+    #   i.e. a problem's relative weight halves every h problems. Counts are
+    #   rescaled (rarely) before the weights overflow.
+    # - window=n: only the last n problems count; the one leaving the window
+    #   is subtracted again.
+    # Either way an update only touches the keys of the strategies involved.
+
+    RESCALE_AT = 2.0 ** 512
+
+    def __init__(self, halfLife=None, window=None):
+        super().__init__(Counter)
+        if halfLife is not None and window is not None:
+            raise ValueError("StratHistory takes either a halfLife or a window, not both")
+        self.halfLife = halfLife
+        self.window = window
+        self.nextWeight = 1.0               # weight of the next problem, for halfLife
+        self.added = 0                      # problems added so far (whatever their weight)
+        self.recent = deque()               # the last `window` strategies (as item tuples), oldest first
+
+        self.best = {}                      # key -> most common value
+        self.cefWeights = defaultdict(int)  # CEF -> sum of weight * count
+        self.rank = defaultdict(dict)       # key -> value -> insertion order (for most_common ties)
+        self.fullStrats = Counter()         # whole strategies (as item tuples), for topStrats
+
+    def __reduce__(self):
+        # defaultdict's own __reduce__ drops instance attributes.
+        return (StratHistory, (), self.__dict__, None, iter(self.items()))
+
+    @staticmethod
+    def fromCounters(summary):
+        hist = StratHistory()
+        for k, counter in summary.items():
+            for v, count in counter.items():
+                hist.count(k, v, count)
+        return hist
+
+    def config(self):
+        return {"halfLife": self.halfLife, "window": self.window}
+
+    def add(self, strat, weight=1):
+        items = tuple(strat.items())
+        if self.halfLife is not None:
+            weight *= self.nextWeight
+            self.nextWeight *= 2 ** (1 / self.halfLife)
+            if self.nextWeight > StratHistory.RESCALE_AT:
+                factor = 1 / self.nextWeight
+                self.rescale(factor)
+                weight *= factor
+
+        for k, v in items:
+            self.count(k, v, weight)
+        self.fullStrats[items] += weight
+        self.added += 1
+
+        if self.window is not None:
+            self.recent.append(items)
+            if len(self.recent) > self.window:
+                self.remove(self.recent.popleft())
+
+    def remove(self, items, weight=1):
+        # Undo add(dict(items), weight). Only meaningful without halfLife, where
+        # a problem's weight doesn't depend on when it was added.
+        for k, v in items:
+            self.count(k, v, -weight)
+        self.fullStrats[items] -= weight
+        if self.fullStrats[items] <= 0:
+            del self.fullStrats[items]
+
+    def rescale(self, factor):
+        # Multiplying every count by the same factor changes no argmax or ratio.
+        for counter in self.values():
+            for v in counter:
+                counter[v] *= factor
+        for cef in self.cefWeights:
+            self.cefWeights[cef] *= factor
+        for items in self.fullStrats:
+            self.fullStrats[items] *= factor
+        self.nextWeight *= factor
+
+    def topStrats(self, k):
+        # The k strategies E's --auto picked most often, as whole strategies.
+        return [dict(items) for items, _ in self.fullStrats.most_common(k)]
+
+    def count(self, k, v, weight):
+        counter = self[k]
+        if v not in counter:
+            self.rank[k][v] = len(self.rank[k])
+        counter[v] += weight
+
+        if k == "heuristic_def":
+            for w, cef in v:
+                self.cefWeights[cef] += w * weight
+                if self.cefWeights[cef] <= 0:
+                    del self.cefWeights[cef]
+
+        best = self.best.get(k)
+        if best is None or (best != v and self.beats(k, v, best)):
+            self.best[k] = v
+        elif best == v and weight < 0:
+            # Our best value lost weight, so some other value may have overtaken it.
+            for other in counter:
+                if self.beats(k, other, self.best[k]):
+                    self.best[k] = other
+
+    def beats(self, k, v, other):
+        # Same tie-breaking as Counter.most_common: the earlier inserted value wins.
+        counter = self[k]
+        return counter[v] > counter[other] or \
+            (counter[v] == counter[other] and self.rank[k][v] < self.rank[k][other])
+
+    def master(self, all_ones=False):
+        master = {}
+        for k in self:
+            if k == "heuristic_def":
+                if len(self.cefWeights) > 0:
+                    master[k] = scaleHeuristicWeights(self.cefWeights, all_ones)
+            elif self[k][self.best[k]] > 0: # Keys only seen in strategies that have left the window are dropped.
+                master[k] = self.best[k]
+        return master
+
+
+
+
+
 ################### Serialization functions ######################
 
 def unparse(k,v):
@@ -212,6 +1030,8 @@ def serializeStrat(summary):
             indentLevel = 1
             s += "   }\n"
         s += indentLevel*"   " + f"{k}:  {v}\n"
+    if indentLevel == 2:
+        s += "   }\n" # No no_preproc (e.g. an empty strategy) to close the inner block before.
     s += "}"
 
     return s
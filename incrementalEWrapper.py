@@ -4,22 +4,67 @@
 # 1.) It decides whether to run eprover or eprover-ho based on the provided file, $PROBLEM.
 # 2.) It will run using --auto (or --auto-schedule if specified) unless...
 # 3.) The SLH_PERSISTENT_DATA_DIR environment variable is set, in which case...:
-#      a.) E will be run using --auto and --print-strategy with output to $SLH_PERSISTENT_DATA_DIR/tmp/$PROBLEM.
-#      b.) The saved strategy from step 3.a. will be used to update a file "$SLH_PERSISTENT_DATA_DIR/strat_history.pkl":
-#          - containing the counts for every strategy key so that computing 3.c. doesn't require looping over all strategies.
-#      c.) strat_history.pkl will be used to compute $SLH_PERSISTENT_DATA_DIR/MASTER.pid.strat
-#      d.) All of this must be done with locking.
-#          - Lock before 3.b. and unlock after 3.c.
-# 4.) All learning can be reset then by deleting the file "$SLH_PERSISTENT_DATA_DIR/strat_history.pkl"
-# 5.) The MASTER.pid.strat files are passed to E, but can be deleted immediately after use.
-#     - Same with the $SLH_PERSISTENT_DATA_DIR/tmp/$PROBLEM file.
+#      a.) E will be run using --auto and --print-strategy, and stopped as soon as the strategy block is printed.
+#          - Unless the strategy is already in $SLH_PERSISTENT_DATA_DIR/strat_cache, which is keyed by a hash of
+#            the problem text, the executable and E's version, so repeated problems never re-probe.
+#      b.) The saved strategy from step 3.a. is appended as one record to "$SLH_PERSISTENT_DATA_DIR/strat_history.log".
+#          - "$SLH_PERSISTENT_DATA_DIR/strat_history.pkl" is a snapshot of the counts for every strategy key up to some
+#            point in the log, so computing 3.c. only has to fold in the log records written since then.
+#          - The snapshot is refreshed in the background (while E runs) once the log tail passes a size threshold.
+#      c.) The snapshot plus the log tail will be used to compute $SLH_PERSISTENT_DATA_DIR/MASTER.<hash>.strat
+#          - The history keeps the master's per-key argmax and heuristic weight sums up to date as it is updated.
+#          - Set $SLH_STRAT_HALF_LIFE (in problems) or $SLH_STRAT_WINDOW (a number of problems) to make older
+#            problems count for less, or not at all; changing either rebuilds the history from the log.
+#          - With $SLH_STRAT_CLUSTERS=k, the history's strategies are clustered into k groups, each with its own
+#            CLUSTER.<hash>.strat master, and the problem gets the one whose cluster its probed strategy is closest to.
+#            Clusters are cached in $SLH_PERSISTENT_DATA_DIR/strat_clusters.pkl and redone every
+#            $SLH_STRAT_RECLUSTER_EVERY problems.
+#      d.) The append in 3.b. must be done with locking; it is a single small write, so the lock is held briefly.
+#          - $SLH_PERSISTENT_DATA_DIR/lockfile is flock'ed (blocking, up to $SLH_LOCK_TIMEOUT seconds), and
+#            lock wait/hold times are appended to $SLH_PERSISTENT_DATA_DIR/lockfile.stats.
+# 4.) All learning can be reset then by deleting the files "$SLH_PERSISTENT_DATA_DIR/strat_history.{pkl,log}"
+# 4b.) If stratDaemon.py is serving $SLH_PERSISTENT_DATA_DIR, 3.b. and 3.c. are delegated to it over
+#      $SLH_PERSISTENT_DATA_DIR/strat_daemon.sock: it keeps the history in memory and batches the log appends.
+#      If it isn't running, everything above happens in this process as usual.
+#      (All of 3. is stratClient.getMasterStratPath, which incrementalExperiments.py also calls in-process.
+#      This script only imports stratClient, and the rest of helpers only if no daemon answers.)
+# 4c.) With --portfolio, E is run with the master strategy, with $eArgs alone (e.g. --auto) and with the
+#      --portfolioTopK strategies --auto picked most often, all at once; the first to find a proof wins and the
+#      others are killed. If there are more configurations than --cores, their cpu limits are scaled down to fit.
+# 4d.) The CPU time, peak RSS and wall time of every E process started for 3.a. and for the proof attempt itself
+#      are appended to $SLH_PERSISTENT_DATA_DIR/usage.jsonl.
+# 4e.) With $SLH_TRACE set, the wall time of each phase of the call (probe, lock, append, load, merge, prove, ...)
+#      is appended to $SLH_PERSISTENT_DATA_DIR/trace.jsonl (see helpers.traceSummary and benchmark.py).
+# 5.) The MASTER.<hash>.strat files are named by a hash of their content, so every call with the same merge result
+#     reuses one file rather than writing its own. Compacting the history (3.b.) deletes the MASTER, TOP and CLUSTER
+#     files no call has been given for $SLH_STRAT_FILE_MAX_AGE seconds (an hour by default), so they don't pile up.
 
 import os
+import sys
+import time
 import argparse
 
-from helpers import runE, getProbStrat, \
-    loadStratHistory, updateStratHistory, saveStratHistory, makeMasterFromHistory, \
-    obtainLock, releaseLock
+# Only stratClient, which is much quicker to import: helpers is loaded when the
+# history has to be read from the data dir (no daemon) or for --portfolio.
+from stratClient import runE, getMasterStratPath, getStratPaths, eCommand, usageRecord, recordUsage, tracePhase
+
+
+def runPortfolio(args, dataDir):
+    # Race the master strategy, plain eArgs (e.g. --auto) and the top-k historical
+    # strategies against each other, and print the output of whichever proves
+    # the problem first (or of the master strategy if none does).
+    from helpers import splitCpuLimit, raceE
+    stratPaths = getStratPaths(args.problem, dataDir, args.higherOrder, topK=args.portfolioTopK)
+    configs = [stratPaths[0], None] + stratPaths[1:]
+    eArgs = splitCpuLimit(args.eArgs, args.cores / len(configs))
+    t1 = time.monotonic()
+    with tracePhase(dataDir, "portfolio", args.problem):
+        winner, outputs, _, usages = raceE([eCommand(args.problem, eArgs, args.higherOrder, path) for path in configs])
+    recordUsage(dataDir, "portfolio", args.problem, usageRecord(usages, time.monotonic() - t1))
+
+    print(f"# Portfolio: {len(configs)} configurations, winner: {'none' if winner is None else configs[winner] or 'eArgs'}")
+    sys.stdout.flush()
+    sys.stdout.buffer.write(outputs[0 if winner is None else winner])
 
 
 if __name__ == "__main__":
@@ -28,20 +73,20 @@ if __name__ == "__main__":
     parser.add_argument("problem")
     parser.add_argument("--eArgs", default="")
     parser.add_argument("--higherOrder", action="store_true")
+    parser.add_argument("--portfolio", action="store_true", help="race the master strategy against eArgs alone (and --portfolioTopK historical strategies)")
+    parser.add_argument("--portfolioTopK", type=int, default=0)
+    parser.add_argument("--cores", type=int, default=os.cpu_count(), help="cores to split the portfolio's cpu limit across")
     args = parser.parse_args()
 
     if os.environ.get("SLH_PERSISTENT_DATA_DIR") is not None:
         print("Running E with persistent data")
         dataDir = os.environ["SLH_PERSISTENT_DATA_DIR"]
-        lockPath = f"{dataDir}/lockfile"
-        newStrat = getProbStrat(args.problem, dataDir, args.higherOrder) # Saves to $SLH_PERSISTENT_DATA_DIR/tmp/$PROBLEM
-
-        obtainLock(lockPath)
-        stratHist = updateStratHistory(loadStratHistory(dataDir), newStrat) # 3.b.
-        saveStratHistory(stratHist, dataDir)                                # 3.b. 
-        masterStratPath = makeMasterFromHistory(stratHist, dataDir)         # 3.c.
-        releaseLock(lockPath)
-        runE(args, masterStratPath)
+        with tracePhase(dataDir, "total", args.problem):
+            if args.portfolio:
+                runPortfolio(args, dataDir)
+            else:
+                masterStratPath = getMasterStratPath(args.problem, dataDir, args.higherOrder) # 3.a. - 3.d.
+                runE(args, masterStratPath, dataDir)
     else:
         print("Running E without persistent data")
         runE(args, None)
@@ -1,54 +1,170 @@
 import argparse
 import pickle as pkl
-from glob import glob
-from multiprocessing import Pool, Manager
-from rich.progress import track
-import subprocess
-from collections import defaultdict
-from time import sleep, time
-import re
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from rich.progress import Progress, track
+from collections import defaultdict, deque
+from time import time
 import os
+import json
+import shlex
+import signal
+import threading
+
+from stratClient import getStratPaths, eCommand, usageRecord
+from helpers import splitCpuLimit, raceE, SOLVED_STATUSES, summarizeValues, attemptCacheKey, readAttemptCache, \
+    writeAttemptCache, listProblems, cpuLimitOf
 
 
 safePercent = lambda a,b: "undefined" if b == 0 else round(100*a/b,2)
 median = lambda l: sorted(l)[len(l)//2] if len(l) > 0 else "undefined"
 
-def waitForWorkers(asyncResults, numWorkers, timeout=300):
-    t1 = time()
-    while sum(1 for r in asyncResults if not r.ready()) > numWorkers:
-        sleep(0.1)
-        if time() - t1 > timeout:
-            break
-
-    asyncResults = [r for r in asyncResults if not r.ready()]
-    return asyncResults
+USAGE_FIELDS = {"user": "User CPU (s)", "sys": "System CPU (s)", "wall": "Wall time (s)", "maxrss": "Peak RSS (KiB)"}
 
+# Outcomes that more cpu time wouldn't change (E found a model, or its strategy is incomplete and saturated,
+# or the problem couldn't be attempted at all).
+FINAL_STATUSES = SOLVED_STATUSES | {"Satisfiable", "CounterSatisfiable", "GaveUp", "Error"}
 
-def fail(successMap, problem, stdout):
+def fail(problem):
     print(f"Failed: {problem}")
-    successMap[problem] = False
-    # print(stdout[-3000:])
-
-# args = environmentVars, prob, higherOrder, eArgs
-proverTemplate = "{} python incrementalEWrapper.py {} {} --eArgs='{} -l2'"
-def runE(useDataDir, dataDirPath, eArgs, problem, higherOrder, successMap, procCountMap):
-    environmentVars = f"SLH_PERSISTENT_DATA_DIR={dataDirPath}" if useDataDir else ""
-    command = proverTemplate.format(environmentVars, problem, "--higherOrder" if higherOrder else "", eArgs)
-    print(f"Running command: '{command}'")
+
+class ProcessRegistry:
+    # The E processes running for each problem, so the scheduler can kill the
+    # ones whose result it no longer needs (see Experiment.run's cancelSolvedGroups).
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.procs = {}
+        self.cancelled = set()
+
+    def register(self, problem, procs):
+        with self.lock:
+            self.procs[problem] = procs
+            if problem in self.cancelled:
+                self.kill(procs)
+
+    def unregister(self, problem):
+        with self.lock:
+            self.procs.pop(problem, None)
+
+    def cancel(self, problem):
+        with self.lock:
+            self.cancelled.add(problem)
+            self.kill(self.procs.get(problem, []))
+
+    def kill(self, procs):
+        for p in procs:
+            try:
+                os.kill(p.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass # Exited, but not yet reaped.
+
+    def wasCancelled(self, problem):
+        with self.lock:
+            return problem in self.cancelled
+
+class AttemptCache:
+    # The proof attempt cache of a data dir (see helpers.attemptCacheKey), plus
+    # the attempts running in this process: a worker whose key is already being
+    # attempted waits for that result instead of starting the same E run.
+    def __init__(self, dataDir):
+        self.dataDir = dataDir
+        self.lock = threading.Lock()
+        self.inFlight = {} # key -> Event set once its attempt is over
+
+    def claim(self, key):
+        # The cached entry for key, or None if the caller is now the one to attempt it.
+        while True:
+            with self.lock:
+                entry = readAttemptCache(self.dataDir, key)
+                if entry is not None:
+                    return entry
+                attempt = self.inFlight.get(key)
+                if attempt is None:
+                    self.inFlight[key] = threading.Event()
+                    return None
+            attempt.wait()
+
+    def release(self, key, entry):
+        # entry is None if the attempt gave no result worth keeping (e.g. it was cancelled),
+        # in which case one of the waiters takes over.
+        if entry is not None:
+            writeAttemptCache(self.dataDir, key, entry)
+        with self.lock:
+            self.inFlight.pop(key).set()
+
+def runE(useDataDir, dataDirPath, eArgs, problem, higherOrder, registry=None, portfolio=False, portfolioTopK=0, portfolioCores=None,
+         stratPath=None, attemptCache=None, recordStrat=True):
+    # Does what incrementalEWrapper.py does, but in this worker thread and
+    # exec'ing E directly, so each problem costs one E process and nothing else.
+    # With portfolio, several configurations race as in incrementalEWrapper.runPortfolio.
+    # Without useDataDir, E is given stratPath (if any) as its strategy.
+    # With an attemptCache, a previous attempt of the same commands is reused (marked "cached").
+    # Without recordStrat, the problem's strategy isn't added to the history (again).
+    # Returns the result record that Experiment.record logs. A problem that
+    # can't be attempted at all (e.g. unreadable) is recorded with status "Error".
     try:
-        p = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return attemptE(useDataDir, dataDirPath, eArgs, problem, higherOrder, registry, portfolio, portfolioTopK, portfolioCores,
+                        stratPath, attemptCache, recordStrat)
+    except Exception as e:
+        fail(problem)
+        print(f"Error attempting {problem}: {e!r}")
+        return errorResult(problem, e)
+
+def errorResult(problem, e):
+    return {"problem": problem, "status": "Error", "solved": False, "processed": None, "error": repr(e), "strategy": None}
+
+def attemptE(useDataDir, dataDirPath, eArgs, problem, higherOrder, registry, portfolio, portfolioTopK, portfolioCores,
+             stratPath, attemptCache, recordStrat):
+    registry = ProcessRegistry() if registry is None else registry
+    if useDataDir:
+        stratPaths = getStratPaths(problem, dataDirPath, higherOrder, topK=portfolioTopK if portfolio else 0, record=recordStrat)
+    else:
+        stratPaths = [stratPath]
+    configs = list(dict.fromkeys([stratPaths[0], None] + stratPaths[1:])) if portfolio else stratPaths[:1]
+    share = (portfolioCores or len(configs)) / len(configs)
+    commands = [eCommand(problem, splitCpuLimit(f"{eArgs} -l2", share), higherOrder, path) for path in configs]
+
+    if attemptCache is not None:
+        key = attemptCacheKey(commands, dataDirPath)
+        entry = attemptCache.claim(key)
+        if entry is not None:
+            print(f"Cached: {problem}")
+            return {"problem": problem, **entry["result"], "strategy": configs[entry["used"]], "cached": True}
+
+    record = None
+    try:
+        for command in commands:
+            print(f"Running command: '{shlex.join(command)}'")
+
+        t1 = time()
+        winner, _, results, usages = raceE(commands, keepOutput=False,
+                                           onStart=lambda procs: registry.register(problem, procs),
+                                           beforeReap=lambda: registry.unregister(problem))
+        used = 0 if winner is None else winner
+        result = results[used]
 
         # check SZS status:
-        stdout = p.stdout.decode("utf-8")
-        if "SZS status Theorem" in stdout or "SZS status Unsatisfiable" in stdout:
+        status = result.status
+        if registry.wasCancelled(problem):
+            status = "Cancelled"
+        elif result.proved:
             print("Solved")
-            successMap[problem] = True
-            numProcessed = re.search(r"# Processed clauses                    : (\d+)", stdout).group(1)
-            procCountMap[problem] = int(numProcessed)
         else:
-            fail(successMap, problem, stdout)
-    except:
-        fail(successMap, problem, stdout)
+            fail(problem)
+
+        record = {
+            "status": status,
+            "solved": status in SOLVED_STATUSES,
+            "processed": result.processedClauses,
+            "generated": result.generatedClauses,
+            "removed": result.removedClauses,
+            **usageRecord(usages, time() - t1),
+        }
+    finally:
+        if attemptCache is not None:
+            completed = record is not None and record["status"] != "Cancelled"
+            attemptCache.release(key, {"result": record, "used": used} if completed else None)
+
+    return {"problem": problem, **record, "strategy": configs[used]}
 
 
 # getProbId = lambda p: p.split("_prob_")[1].split("_")[0] # should work with full path or just filename
@@ -58,19 +174,75 @@ def getProbId(p):
     else:
         return os.path.split(p)[1]
 
+def interleaveGroups(probGroups):
+    # Round-robin over the groups, so every group gets its first attempt
+    # before any group gets its second.
+    groups = [iter(g) for g in probGroups.values()]
+    while groups:
+        remaining = []
+        for g in groups:
+            p = next(g, None)
+            if p is not None:
+                yield p
+                remaining.append(g)
+        groups = remaining
+
+def escalationLimits(eArgs, first, factor):
+    # The cpu limits of the escalation passes: first, first * factor, ... and finally eArgs' own.
+    maxLimit = cpuLimitOf(eArgs)
+    if maxLimit is None:
+        raise ValueError("Escalating cpu limits needs a --cpu-limit in eArgs")
+    if first <= 0 or factor <= 1:
+        raise ValueError("Escalating cpu limits needs a first limit above 0 and a factor above 1")
+    limits = []
+    while first < maxLimit:
+        limits.append(first)
+        first *= factor
+    return limits + [maxLimit]
+
+def difficultyOrder(problems, experimentPaths):
+    # problems sorted easiest first, as predicted by earlier experiments (matched by file name):
+    # those they solved by processed clauses, then those they didn't attempt (by the mean of
+    # their group, if any of it was solved), then those they attempted but didn't solve.
+    processed, unsolved = defaultdict(list), set()
+    for path in experimentPaths:
+        exp = Experiment.load(path)
+        for p, solved in exp.successMap.items():
+            if solved and p in exp.procCountMap:
+                processed[os.path.basename(p)].append(exp.procCountMap[p])
+            elif not solved:
+                unsolved.add(os.path.basename(p))
+
+    groupProcessed = defaultdict(list)
+    for name, counts in processed.items():
+        groupProcessed[getProbId(name)].append(min(counts))
+
+    def difficulty(p):
+        name = os.path.basename(p)
+        if name in processed:
+            return (0, min(processed[name]))
+        if name not in unsolved:
+            group = groupProcessed.get(getProbId(name))
+            return (1, sum(group) / len(group)) if group else (1, float("inf"))
+        return (2, 0)
+    return sorted(problems, key=difficulty)
+
 
 
 class Experiment:
 
-    def __init__(self, name, path, higherOrder, problems, eArgs, useDataDir, dataDirPath):
+    def __init__(self, name, path, higherOrder, problems, eArgs, useDataDir, dataDirPath="data_dir", problemStrats=None):
         self.name = name
         self.path = path
         self.higherOrder = higherOrder
         self.problems = problems # set of problem paths
+        self.problemStrats = problemStrats # problem -> strategy file to run it with (e.g. its cross-validation fold's master)
 
-        self.manager = Manager()
-        self.successMap = self.manager.dict()
-        self.procCountMap = self.manager.dict()
+        self.successMap = {}
+        self.procCountMap = {}
+        self.usageMap = {}  # problem -> user/sys CPU and wall seconds, and peak RSS (KiB) of E
+        self.escalations = {} # problem -> its last unsolved attempt under a smaller cpu limit (see run's escalate)
+        self.log = None
 
         self.eArgs = eArgs
         self.finished = False
@@ -79,30 +251,78 @@ class Experiment:
 
     @staticmethod
     def load(path):
+        if path.endswith(".jsonl"):
+            return Experiment.fromLog(path)
         with open(path, "rb") as f:
             obj = pkl.load(f)
         return obj
 
     def save(self):
-        # Temporarily replace manager dictionaries with regular dictionaries for pickling
-        temp_successMap = dict(self.successMap)
-        temp_procCountMap = dict(self.procCountMap)
-        temp_manager = self.manager
-
-        # Temporarily unset the manager dictionaries in self
-        self.manager = None
-        self.successMap, self.procCountMap = temp_successMap, temp_procCountMap
-
-        # Save the instance of Experiment without Manager attributes
         with open(f"{self.name}.results.pkl", "wb") as f:
             pkl.dump(self, f)
 
-        # Restore the managed dictionaries
-        self.manager = temp_manager
-        self.successMap = self.manager.dict(temp_successMap)
-        self.procCountMap = self.manager.dict(temp_procCountMap)
+    # Every result is also appended to {name}.results.jsonl as soon as it
+    # completes, after a header line describing the experiment, so a run that
+    # dies keeps its results, can be resumed, and can be loaded without the pickle.
+    def logPath(self):
+        return f"{self.name}.results.jsonl"
+
+    def openLog(self, resume):
+        if resume and os.path.exists(self.logPath()):
+            self.replayLog()
+            self.truncateLog()
+        else:
+            with open(self.logPath(), "w") as f:
+                header = {"name": self.name, "path": self.path, "higherOrder": self.higherOrder, "problems": self.problems,
+                          "eArgs": self.eArgs, "useDataDir": self.useDataDir, "dataDirPath": self.dataDirPath,
+                          "problemStrats": self.problemStrats}
+                f.write(json.dumps({"experiment": header}) + "\n")
+        self.log = open(self.logPath(), "a")
+
+    def record(self, result):
+        if result.get("final", True) is False:
+            self.escalations[result["problem"]] = result
+        else:
+            self.recordFinal(result)
+
+        if self.log is not None:
+            self.log.write(json.dumps(result) + "\n")
+            self.log.flush()
+
+    def recordFinal(self, result):
+        self.successMap[result["problem"]] = result["solved"]
+        if result["processed"] is not None and result["solved"]:
+            self.procCountMap[result["problem"]] = result["processed"]
+        self.usageMap[result["problem"]] = {k: result[k] for k in USAGE_FIELDS if k in result}
+
+    def truncateLog(self):
+        # Drop a last line cut short by a crash, so appending starts on a line of its own.
+        with open(self.logPath(), "rb+") as f:
+            data = f.read()
+            if not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def replayLog(self):
+        with open(self.logPath()) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue # A line cut short by a crash is just retried.
+                if "problem" in entry:
+                    self.record(entry)
+                elif entry.get("finished"):
+                    self.finished = True
+
+    @staticmethod
+    def fromLog(path):
+        with open(path) as f:
+            header = json.loads(f.readline())["experiment"]
+        exp = Experiment(header["name"], header["path"], header["higherOrder"], header["problems"],
+                         header["eArgs"], header["useDataDir"], header["dataDirPath"], header.get("problemStrats"))
+        exp.replayLog()
+        return exp
 
-        
     def __repr__(self):
         solved = len({k for k in self.successMap.keys() if self.successMap[k]})
         return f"""
@@ -134,8 +354,35 @@ Median processed clauses: {median(list(self.procCountMap.values()))}
             print(f"""Average processesed clauses: {sum(procCountMap.values()) / max(len(procCountMap),1):.2f}
 Median processesed clauses: {median(list(procCountMap.values()))} 
             """)
+            exp.printUsage()
+
+    def nextPass(self, problem, cpuLimits):
+        # The first of cpuLimits larger than that of the problem's last unfinished attempt.
+        previous = getattr(self, "escalations", {}).get(problem)
+        if previous is None or cpuLimits[0] is None:
+            return 0
+        return min(sum(1 for limit in cpuLimits if limit <= previous["cpuLimit"]), len(cpuLimits) - 1)
+
+    def addEarlierAttempts(self, result):
+        # Make result's usage cover the problem's earlier (unfinished) attempts too.
+        previous = self.escalations.get(result["problem"])
+        if previous is None:
+            return
+        for k in ["user", "sys", "wall"]:
+            result[k] = result.get(k, 0) + previous.get(k, 0)
+        result["maxrss"] = max(result.get("maxrss", 0), previous.get("maxrss", 0))
+
+    def printUsage(self):
+        # Resource use over every attempted problem (not just those solved by all),
+        # since that is what sizes worker counts and memory per node.
+        usages = getattr(self, "usageMap", {}).values()
+        for k in USAGE_FIELDS:
+            summary = summarizeValues(sorted(u[k] for u in usages if k in u))
+            if summary:
+                print(f"{USAGE_FIELDS[k]}: " + ", ".join(f"{stat} {v:.2f}" for stat, v in summary.items()))
     
-    def run(self, numWorkers=4):
+    def run(self, numWorkers=4, resume=True, cancelSolvedGroups=False, portfolio=False, portfolioTopK=0, portfolioCores=None,
+            cacheAttempts=False, escalate=None, escalationFactor=4, difficultyFrom=()):
 
         # problem files are formatted like:
         # timestamp_random_prob_id_sequentialIgnore.p
@@ -151,42 +398,146 @@ Median processesed clauses: {median(list(procCountMap.values()))}
         for p in track(self.problems, description="Grouping"):
             probGroups[getProbId(p)].append(p)
 
-        groupsAttempted = set()
-        with Pool(numWorkers) as p:
-            tasks = []
-            t1 = time()
-            for i, problem in enumerate(track(self.problems, description="Running")):
-                tasks.append(p.apply_async(runE, args=(self.useDataDir, self.dataDirPath, self.eArgs, problem, self.higherOrder, self.successMap, self.procCountMap)))
-                groupsAttempted.add(getProbId(problem))
-
-                tasks = waitForWorkers(tasks, numWorkers)
+        # Results come back by value as each E run finishes, and a new problem is
+        # submitted for every one that completes, so exactly numWorkers E processes
+        # are running at any time. Progress is kept in running counters.
+        #
+        # With cancelSolvedGroups, a group counts as solved once any of its variants
+        # is proved: its queued variants are skipped, its running ones are killed
+        # (and not logged, so they count as never attempted), and groups are
+        # interleaved so that every group gets an early first attempt.
+        #
+        # With portfolio, each problem races the master strategy against plain
+        # eArgs and the portfolioTopK most common historical strategies, with the
+        # cpu limit split over portfolioCores (by default each gets a full core).
+        #
+        # With cacheAttempts, attempts are memoized in the data dir (see helpers.attemptCacheKey),
+        # so duplicate problems and reruns with unchanged strategies don't run E again.
+        #
+        # With escalate, every problem first gets a cpu limit of escalate seconds. Those
+        # that run out of time are queued again with escalationFactor times the limit, up
+        # to the limit in eArgs, behind all problems still waiting for a shorter attempt.
+        # Only a problem's last attempt counts as its result (with the cpu time and wall
+        # time of all its attempts); the earlier ones are logged with "final": false.
+        #
+        # With difficultyFrom (earlier experiments' result files), problems are attempted
+        # easiest first, by how many clauses those experiments needed to process.
+        self.openLog(resume)
+        order = interleaveGroups(probGroups) if cancelSolvedGroups else self.problems
+        if difficultyFrom:
+            order = difficultyOrder(order, difficultyFrom)
+        cpuLimits = escalationLimits(self.eArgs, escalate, escalationFactor) if escalate is not None else [None]
+        passes = [deque() for _ in cpuLimits] # problems waiting for an attempt with each cpu limit
+        for problem in order:
+            if problem not in self.successMap:
+                passes[self.nextPass(problem, cpuLimits)].append(problem)
+        numEscalated = 0
+        numAttempted = len(self.successMap)
+        numSolved = sum(1 for solved in self.successMap.values() if solved)
+        totalProcessed = sum(self.procCountMap.values())
+        attemptedGroups = {getProbId(p) for p in self.successMap}
+        successGroups = {getProbId(p) for p, solved in self.successMap.items() if solved}
+        numResumed = numAttempted
+        numSkipped = 0
+        if numAttempted > 0:
+            print(f"Resuming: {numAttempted} / {len(self.problems)} already attempted")
+
+        registry = ProcessRegistry()
+        attemptCache = AttemptCache(self.dataDirPath) if cacheAttempts else None
+        inFlight = defaultdict(set) # group id -> problems running
+
+        with ThreadPoolExecutor(numWorkers) as pool, Progress() as progress:
+            task_id = progress.add_task("Running", total=len(self.problems), completed=numAttempted)
+
+            def nextProblem():
+                # The next problem of the pass with the smallest cpu limit, and that pass.
+                nonlocal numSkipped
+                for level, pending in enumerate(passes):
+                    while pending:
+                        problem = pending.popleft()
+                        if cancelSolvedGroups and getProbId(problem) in successGroups:
+                            numSkipped += 1
+                            progress.advance(task_id)
+                            continue
+                        return problem, level
+                return None, None
+
+            def submitNext():
+                problem, level = nextProblem()
+                if problem is not None:
+                    inFlight[getProbId(problem)].add(problem)
+                    stratPath = (getattr(self, "problemStrats", None) or {}).get(problem)
+                    eArgs = self.eArgs if cpuLimits[level] is None else splitCpuLimit(self.eArgs, cpuLimits[level] / cpuLimits[-1])
+                    future = pool.submit(runE, self.useDataDir, self.dataDirPath, eArgs, problem, self.higherOrder,
+                                         registry, portfolio, portfolioTopK, portfolioCores, stratPath, attemptCache,
+                                         recordStrat=problem not in self.escalations)
+                    levels[future] = level
+                    running.add(future)
+
+            levels = {} # future -> index of its cpu limit
+            running = set()
+            for _ in range(numWorkers):
+                submitNext()
 
-                if i % 20 == 0:
-                    minsElapsed = (time() - t1) / 60
-                    attemptsPerMin = i / minsElapsed
-                    if attemptsPerMin > 0:
-                        leftToAttempt = len(self.problems) - i
+            t1 = time()
+            while running:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    level = levels.pop(future)
+                    problem = result["problem"]
+                    inFlight[getProbId(problem)].discard(problem)
+                    if result["solved"] and cancelSolvedGroups:
+                        for sibling in inFlight[getProbId(problem)]:
+                            registry.cancel(sibling)
+                    if result["solved"]:
+                        successGroups.add(getProbId(problem))
+                    if cpuLimits[level] is not None and result["status"] != "Cancelled":
+                        self.addEarlierAttempts(result)
+                        result["cpuLimit"] = cpuLimits[level]
+                        if result["status"] not in FINAL_STATUSES and level + 1 < len(cpuLimits):
+                            result["final"] = False
+                            passes[level + 1].append(problem)
+                    submitNext()
+
+                    if result.get("final", True) is False:
+                        self.record(result)
+                        numEscalated += 1
+                        continue
+                    progress.advance(task_id)
+
+                    if result["status"] == "Cancelled":
+                        numSkipped += 1
+                        continue
+
+                    self.record(result)
+                    numAttempted += 1
+                    attemptedGroups.add(getProbId(problem))
+                    if result["solved"]:
+                        numSolved += 1
+                        totalProcessed += self.procCountMap.get(problem, 0)
+
+                    if numAttempted % 20 == 0:
+                        minsElapsed = (time() - t1) / 60
+                        attemptsPerMin = (numAttempted - numResumed) / minsElapsed
+                        leftToAttempt = len(self.problems) - numAttempted - numSkipped
                         minsLeft = leftToAttempt / attemptsPerMin
                         print(f"{attemptsPerMin:.2f} attempts/min (Hours remaining: {round(minsLeft / 60, 2)})")
-                    
-                    
-                    numSolved = len({k for k in self.successMap.keys() if self.successMap[k]})
-                    print(f"{i} / {len(self.problems)} attempted ({numSolved} solved)")
-
-                    successGroups = {getProbId(k) for k in self.successMap.keys() if self.successMap[k]}
-                    attemptedGroups = {getProbId(k) for k in self.successMap.keys()}
-                    print("{} / {} groups have successful attempts ({}%)".format(
-                        len(successGroups), 
-                        len(attemptedGroups), 
-                        safePercent(len(successGroups), len(attemptedGroups))
-                    ))
-
-                    print(self)
-
-            tasks = waitForWorkers(tasks, 0) # Wait for all remaining tasks to complete
+                        print(f"{numAttempted} / {len(self.problems)} attempted ({numSolved} solved, {numSkipped} skipped, "
+                              f"{numEscalated} retried with a larger cpu limit)")
+                        print("{} / {} groups have successful attempts ({}%)".format(
+                            len(successGroups),
+                            len(attemptedGroups),
+                            safePercent(len(successGroups), len(attemptedGroups))
+                        ))
+                        print(f"Average processed clauses: {totalProcessed / max(len(self.procCountMap),1):.2f}")
 
         self.finished = True
+        self.log.write(json.dumps({"finished": True}) + "\n")
+        self.log.close()
+        self.log = None
         self.save()
+        print(self)
 
 
 
@@ -199,12 +550,29 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("name")
     parser.add_argument("problemsPath")
+    parser.add_argument("--manifest", default=None, help="only run the problems listed (one per line) in this file")
     parser.add_argument("--useDataDir", action="store_true")
     parser.add_argument("--dataDirPath", default="data_dir")
     parser.add_argument("--higherOrder", action="store_true")
     parser.add_argument("--eArgs", default="")
     parser.add_argument("--numWorkers", type=int, default=4)
+    parser.add_argument("--restart", action="store_true", help="discard results logged by an earlier run with this name instead of resuming it")
+    parser.add_argument("--cancelSolvedGroups", action="store_true", help="stop attempting a problem's other _prob_<ID>_ variants once one is proved")
+    parser.add_argument("--portfolio", action="store_true", help="race the master strategy against eArgs alone (and --portfolioTopK historical strategies)")
+    parser.add_argument("--portfolioTopK", type=int, default=0)
+    parser.add_argument("--portfolioCores", type=int, default=None, help="cores each problem's portfolio may use (default: one per configuration)")
+    parser.add_argument("--cacheAttempts", action="store_true", help="reuse results of identical earlier attempts (same problem text, strategy and eArgs) from the data dir")
+    parser.add_argument("--escalate", type=int, default=None, help="first attempt every problem with this cpu limit (s), then retry those that ran out of time with larger ones")
+    parser.add_argument("--escalationFactor", type=int, default=4, help="how much larger each retry's cpu limit is")
+    parser.add_argument("--difficultyFrom", nargs="+", default=(), help="results of earlier experiments, to attempt the problems they found easiest first")
     args = parser.parse_args()
-
-    exp = Experiment(args.name, args.problemsPath, args.higherOrder, sorted(glob(f"{args.problemsPath}/*.p")), args.eArgs, args.useDataDir, args.dataDirPath)
-    exp.run(numWorkers=args.numWorkers)
\ No newline at end of file
+    if args.escalate is not None and args.escalate <= 0:
+        parser.error("--escalate must be a cpu limit above 0 seconds")
+    if args.escalationFactor <= 1:
+        parser.error("--escalationFactor must be above 1")
+
+    exp = Experiment(args.name, args.problemsPath, args.higherOrder, listProblems(args.problemsPath, args.manifest), args.eArgs, args.useDataDir, args.dataDirPath)
+    exp.run(numWorkers=args.numWorkers, resume=not args.restart, cancelSolvedGroups=args.cancelSolvedGroups,
+            portfolio=args.portfolio, portfolioTopK=args.portfolioTopK, portfolioCores=args.portfolioCores,
+            cacheAttempts=args.cacheAttempts, escalate=args.escalate, escalationFactor=args.escalationFactor,
+            difficultyFrom=args.difficultyFrom)
\ No newline at end of file
@@ -1,22 +1,22 @@
 import argparse
-from glob import glob
 from rich.progress import Progress, track
-from helpers import getProbStrat, updateStratHistory, makeMasterFromHistory
-from collections import defaultdict, Counter
-from incrementalExperiments import Experiment
-import os
+from stratClient import getProbStrat
+from helpers import updateStratHistory, makeMasterFromHistory, StratHistory, listProblems
+from collections import defaultdict
+from incrementalExperiments import Experiment, getProbId, safePercent
+from statistics import mean, stdev
 from multiprocessing import Pool
 
 # Ensure getProbStrat is picklable
 def process_file(args):
     p, dataDir, higherOrder = args
-    probName = os.path.split(p)[1]
     strat = getProbStrat(p, dataDir, higherOrder)
-    return (probName, strat)
+    return (p, strat)
 
-def getMasterStrat(args):
+def getProbStrats(args):
+    # The one probing pass: {problem path: the strategy E's --auto picks for it}.
     dataDir = f"{args.problemsPath}/data_dir"
-    file_list = glob(f"{args.problemsPath}/*.p")
+    file_list = listProblems(args.problemsPath, args.manifest)
     higherOrder = args.higherOrder
 
     # Prepare list of arguments for multiprocessing
@@ -31,16 +31,71 @@ def getMasterStrat(args):
                 results.append(result)
                 progress.advance(task_id)
 
-    # Collect strategies into a dictionary
-    strats = dict(results)
+    # Collect strategies into a dictionary, leaving out problems whose probe failed
+    return {p: strat for p, strat in results if strat is not None}
+
+def getMasterStrat(args, strats=None):
+    strats = getProbStrats(args) if strats is None else strats
 
     # Update strategy history
-    stratHistory = defaultdict(Counter)
+    stratHistory = StratHistory()
     for p, strat in track(strats.items(), description="Updating strategy history"):
         updateStratHistory(stratHistory, strat)
 
-    return makeMasterFromHistory(stratHistory, dataDir)
+    return makeMasterFromHistory(stratHistory, f"{args.problemsPath}/data_dir")
+
+
+
+######## Cross-validation ###############################
+# Evaluating the master on the problems it was merged from flatters it. Instead
+# the problems are split into folds (never splitting a getProbId group, whose
+# variants would otherwise leak between training and test), and each fold is
+# run with the master of all the other folds. That master is the full history
+# minus the fold's strategies, so no problem is probed or merged twice. As every
+# problem is in exactly one fold, all folds together are one Experiment over
+# all problems, run on a single worker pool with a per-problem strategy.
+
+def makeFolds(problems, k=None):
+    # k folds of whole groups, balanced by problem count, or one fold per group if k is None.
+    probGroups = defaultdict(list)
+    for p in sorted(problems):
+        probGroups[getProbId(p)].append(p)
+    if k is None:
+        return list(probGroups.values())
+
+    folds = [[] for _ in range(min(k, len(probGroups)))]
+    for _, group in sorted(probGroups.items(), key=lambda g: (-len(g[1]), g[0])):
+        min(folds, key=len).extend(group)
+    return folds
+
+def makeFoldMasters(strats, folds, dataDir):
+    # The path of each fold's training master: its strategies are subtracted
+    # from the full history, the master is written, and they are added back.
+    stratHistory = StratHistory()
+    for strat in strats.values():
+        updateStratHistory(stratHistory, strat)
+
+    masterPaths = []
+    for fold in track(folds, description="Making fold masters"):
+        probed = [p for p in fold if p in strats]
+        for p in probed:
+            stratHistory.remove(tuple(strats[p].items()))
+        masterPaths.append(makeMasterFromHistory(stratHistory, dataDir))
+        for p in probed:
+            stratHistory.add(strats[p])
+    return masterPaths
 
+def printFoldReport(exp, folds):
+    rates = []
+    for i, fold in enumerate(folds):
+        attempted = [p for p in fold if p in exp.successMap]
+        solved = sum(1 for p in attempted if exp.successMap[p])
+        if len(attempted) > 0:
+            rates.append(solved / len(attempted))
+        if len(folds) <= 20:
+            print(f"Fold {i}: solved {solved} / {len(attempted)} ({safePercent(solved, len(attempted))}%)")
+    if len(rates) > 1:
+        print(f"Solved per fold: mean {100 * mean(rates):.2f}%, stdev {100 * stdev(rates):.2f}% over {len(rates)} folds")
 
 
 
@@ -51,27 +106,44 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("name")
     parser.add_argument("problemsPath")
+    parser.add_argument("--manifest", default=None, help="only use the problems listed (one per line) in this file")
     parser.add_argument("--higherOrder", action="store_true")
     parser.add_argument("--eArgs", default="")
     parser.add_argument("--numWorkers", type=int, default=4)
     parser.add_argument("--numWorkersStratCuration", type=int, default=4)
     parser.add_argument("--alternateStrat", default="", type=str, help="use a given strategy instead of doing merging here.")
+    parser.add_argument("--crossValidate", type=int, default=0, help="run each of this many folds (of whole problem groups) with the master merged from the others")
+    parser.add_argument("--leaveGroupOut", action="store_true", help="cross-validate with one fold per _prob_<ID>_ group")
+    parser.add_argument("--cacheAttempts", action="store_true", help="reuse results of identical earlier attempts (same problem text, strategy and eArgs)")
 
     args = parser.parse_args()
 
-    if args.alternateStrat != "":
-        print("Using alternate strategy")
-        masterStratPath = args.alternateStrat
+    problems = listProblems(args.problemsPath, args.manifest)
+    problemStrats = None
+    if args.crossValidate > 0 or args.leaveGroupOut:
+        folds = makeFolds(problems, None if args.leaveGroupOut else args.crossValidate)
+        masterPaths = makeFoldMasters(getProbStrats(args), folds, f"{args.problemsPath}/data_dir")
+        problemStrats = {p: path for fold, path in zip(folds, masterPaths) for p in fold}
+        eArgs = args.eArgs
     else:
-        masterStratPath = getMasterStrat(args)
+        if args.alternateStrat != "":
+            print("Using alternate strategy")
+            masterStratPath = args.alternateStrat
+        else:
+            masterStratPath = getMasterStrat(args)
+        eArgs = f"{args.eArgs} --parse-strategy={masterStratPath}"
 
     exp = Experiment(
         name=args.name,
         path=args.problemsPath,
         higherOrder=args.higherOrder,
-        problems=glob(f"{args.problemsPath}/*.p"),
-        eArgs=f"{args.eArgs} --parse-strategy={masterStratPath}",
+        problems=problems,
+        eArgs=eArgs,
         useDataDir=False,
+        dataDirPath=f"{args.problemsPath}/data_dir",
+        problemStrats=problemStrats,
     )
 
-    exp.run(numWorkers=args.numWorkers)
+    exp.run(numWorkers=args.numWorkers, cacheAttempts=args.cacheAttempts)
+    if problemStrats is not None:
+        printFoldReport(exp, folds)
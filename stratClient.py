@@ -0,0 +1,348 @@
+# What a wrapper call needs when stratDaemon.py serves its data dir: running
+# E, probing (or looking up) the problem's strategy, usage records, tracing
+# and the daemon client. It imports much less than helpers.py, which the
+# wrapper only loads when no daemon answers and the history has to be read
+# from the data dir (see getStratPaths). helpers.py imports it from here too.
+
+import os, re, shlex, signal, subprocess, pickle, hashlib, threading, time, json, socket
+from contextlib import contextmanager
+
+def eproverPath(higherOrder):
+    # $SLH_EPROVER_DIR points somewhere else than the usual checkout, e.g. at a stub E for benchmark.py.
+    executable = "eprover-ho" if higherOrder else "eprover"
+    return f"{os.environ.get('SLH_EPROVER_DIR', './eprover/PROVER')}/{executable}"
+
+def eCommand(problem, eArgs, higherOrder, masterStratPath=None):
+    # An argument vector, so E can be exec'd directly rather than through a shell.
+    command = [eproverPath(higherOrder), *shlex.split(eArgs)]
+    if masterStratPath is not None:
+        command.append(f"--parse-strategy={masterStratPath}")
+    command.append(problem)
+    return command
+
+def runE(args, masterStratPath, dataDir=None):
+    command = eCommand(args.problem, args.eArgs, args.higherOrder, masterStratPath)
+
+    # print(f"Running command: '{command}'")
+    t1 = time.monotonic()
+    with tracePhase(dataDir, "prove", args.problem):
+        usage = waitWithUsage(subprocess.Popen(command))
+    if dataDir is not None:
+        recordUsage(dataDir, "prove", args.problem, usageRecord([usage], time.monotonic() - t1))
+
+def waitWithUsage(p, beforeReap=None):
+    # Reap p ourselves with wait4, since Popen.wait throws the child's rusage away.
+    # beforeReap runs once p has exited but while its PID can't yet be reused,
+    # so whoever might still signal p can be told to stop first.
+    if beforeReap is not None:
+        os.waitid(os.P_PID, p.pid, os.WEXITED | os.WNOWAIT)
+        beforeReap()
+    _, status, usage = os.wait4(p.pid, 0)
+    p.returncode = os.waitstatus_to_exitcode(status)
+    return usage
+
+def getMasterStratPath(problem, dataDir, higherOrder):
+    return getStratPaths(problem, dataDir, higherOrder)[0]
+
+def getStratPaths(problem, dataDir, higherOrder, topK=0, record=True):
+    # Everything the wrapper does with a persistent data dir before running E:
+    # probe (or look up) the problem's strategy, record it in the history and
+    # return the path of the resulting master strategy (that of the problem's
+    # cluster, with SLH_STRAT_CLUSTERS), followed by the paths of the topK
+    # most common historical strategies (for portfolio runs).
+    # Without record the history is left as it is, e.g. when retrying a problem.
+    # A problem whose strategy couldn't be probed isn't recorded either.
+    os.makedirs(dataDir, exist_ok=True)
+    with tracePhase(dataDir, "probe", problem):
+        newStrat = getProbStrat(problem, dataDir, higherOrder)
+    record = record and newStrat is not None
+
+    with tracePhase(dataDir, "daemon", problem):
+        stratPaths = requestStratPathsFromDaemon(dataDir, newStrat, topK, record)
+    if stratPaths is not None:
+        return stratPaths
+
+    from helpers import getStratPathsFromFiles # The rest of helpers is only imported when no daemon answers.
+    return getStratPathsFromFiles(problem, dataDir, newStrat, topK, record)
+
+
+def getProbStrat(problem, dataDir, higherOrder, useCache=True):
+    executable = eproverPath(higherOrder)
+
+    if useCache:
+        cacheKey = stratCacheKey(problem, executable, dataDir)
+        strat = readStratCache(dataDir, cacheKey)
+        if strat: # Older versions cached failed probes as {}, which are probed again.
+            return strat
+    
+    lines, usage, complete = probeStratLines(executable, problem)
+    recordUsage(dataDir, "probe", problem, usage)
+    if not complete:
+        return None # E failed before printing its strategy; maybe it won't next time, so nothing is cached.
+    strat = parseStratLines(lines)
+    if useCache:
+        writeStratCache(dataDir, cacheKey, strat)
+    return strat
+
+def probeStratLines(executable, problem):
+    # E prints the strategy block before it starts searching, so read its
+    # stdout as it is produced and stop E as soon as the block is closed
+    # instead of letting it run (up to the cpu limit) on a proof we discard.
+    # Returns the lines of the block, the probe's usageRecord and whether the
+    # block was closed (it isn't if E errored or was killed before printing it all).
+    command = [executable, "--auto", "--print-strategy", "--cpu-limit=120", problem]
+    t1 = time.monotonic()
+    p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+
+    lines = []
+    depth = 0
+    complete = False
+    try:
+        for line in p.stdout:
+            token = line.strip()
+            if token == "{":
+                depth += 1
+            elif token == "}":
+                depth -= 1
+                if depth == 0:
+                    complete = True
+                    break
+            elif depth > 0:
+                lines.append(line)
+    finally:
+        os.kill(p.pid, signal.SIGKILL) # p isn't reaped yet, so its PID is still ours to signal.
+        p.stdout.close()
+        usage = waitWithUsage(p)
+
+    return lines, usageRecord([usage], time.monotonic() - t1), complete
+
+
+
+
+
+###### Resource accounting #################################
+# Every E child is reaped with wait4 (see waitWithUsage), and its CPU time,
+# peak RSS and wall time are kept: in the experiment results, and for the
+# wrapper's probes and proof attempts in $dataDir/usage.jsonl.
+
+def usageRecord(usages, wall):
+    # One record for one or more E processes that ran side by side: their
+    # total CPU seconds, the largest peak RSS (KiB) of any one, and wall seconds.
+    return {
+        "user": sum(u.ru_utime for u in usages),
+        "sys": sum(u.ru_stime for u in usages),
+        "maxrss": max(u.ru_maxrss for u in usages),
+        "wall": wall,
+    }
+
+def recordUsage(dataDir, kind, problem, record):
+    entry = {"time": time.time(), "kind": kind, "problem": problem, **record}
+    try:
+        with open(f"{dataDir}/usage.jsonl", "a") as f:
+            f.write(json.dumps(entry) + "\n")
+    except OSError:
+        pass
+
+
+
+
+
+###### Phase tracing ########################################
+# With $SLH_TRACE set, each phase of a call (probing, waiting for the data dir
+# lock, loading the history, merging, E itself, ...) appends one record with
+# its wall time to $dataDir/trace.jsonl. traceSummary summarizes them by phase.
+
+TRACE = bool(os.environ.get("SLH_TRACE"))
+
+def tracePath(dataDir):
+    return f"{dataDir}/trace.jsonl"
+
+@contextmanager
+def tracePhase(dataDir, phase, problem=None):
+    if not TRACE or dataDir is None:
+        yield
+        return
+    start, t1 = time.time(), time.monotonic()
+    try:
+        yield
+    finally:
+        entry = {"time": start, "pid": os.getpid(), "thread": threading.get_ident(),
+                 "problem": problem, "phase": phase, "seconds": time.monotonic() - t1}
+        try:
+            with open(tracePath(dataDir), "a") as f:
+                f.write(json.dumps(entry) + "\n")
+        except OSError:
+            pass
+
+
+
+
+
+###### Parsing E's strategy output #########################
+
+def parseStratValue(v):
+    if v == "true":
+        return True
+    elif v == "false":
+        return False
+    elif v.startswith('"') and v.endswith('"'):
+        return v[1:-1]
+    else:
+        try:
+            return int(v)
+        except:
+            try:
+                return float(v)
+            except:
+                return v
+
+HEURISTIC_CEF = re.compile(r"([0-9]+)[.*](\w+\([^\)]*\))")
+
+def parseHeuristicDef(heuristicDef):
+    # '"(3.FIFOWeight(PreferProcessed),1.Clauseweight(...))"' -> ((1, "Clauseweight(...)"), (3, "FIFOWeight(PreferProcessed)"))
+    return tuple(sorted([(int(w),f) for w,f in HEURISTIC_CEF.findall(heuristicDef)]))
+
+def parseStratLines(lines):
+    lines = [l for l in lines if not l.startswith("#") and len(l.strip()) > 1 and ":" in l]
+
+    strat = {k.strip():v.strip() for k,v in [l.split(":") for l in lines]}
+    assert len(strat) == len(lines) # There should be no duplicate keys.
+
+    for k,v in strat.items():
+        strat[k] = parseStratValue(v)
+    
+    if "heuristic_def" in strat:
+        strat["heuristic_def"] = parseHeuristicDef(strat["heuristic_def"])
+
+    return strat
+
+
+
+
+
+###### Probed strategy cache ################################
+# Probing a problem for its --auto strategy costs a full E run, but the
+# result only depends on the problem text and the E binary, so it is cached
+# under $dataDir/strat_cache keyed by a hash of exactly those things.
+
+STRAT_CACHE_MAX_ENTRIES = int(os.environ.get("SLH_STRAT_CACHE_MAX_ENTRIES", 50000))
+_eVersions = {}
+
+def stratCacheDir(dataDir):
+    return f"{dataDir}/strat_cache"
+
+def eproverVersion(executable, dataDir):
+    # Asking E for its version is a subprocess too, so the answer is memoized
+    # (in memory and on disk) against the binary's inode, size and mtime.
+    st = os.stat(executable)
+    statKey = f"{os.path.abspath(executable)}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+    if statKey in _eVersions:
+        return _eVersions[statKey]
+
+    versionPath = f"{stratCacheDir(dataDir)}/version.{hashlib.sha1(statKey.encode()).hexdigest()}"
+    if os.path.exists(versionPath):
+        with open(versionPath) as f:
+            version = f.read()
+    else:
+        p = subprocess.run([executable, "--version"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        version = p.stdout.decode("utf-8", errors="replace").strip()
+        os.makedirs(stratCacheDir(dataDir), exist_ok=True)
+        atomicWrite(versionPath, version.encode())
+
+    _eVersions[statKey] = version
+    return version
+
+def stratCacheKey(problem, executable, dataDir):
+    h = hashlib.sha256()
+    with open(problem, "rb") as f:
+        h.update(f.read())
+    h.update(b"\0" + os.path.basename(executable).encode())
+    h.update(b"\0" + eproverVersion(executable, dataDir).encode())
+    return h.hexdigest()
+
+def readStratCache(dataDir, cacheKey):
+    entryPath = f"{stratCacheDir(dataDir)}/{cacheKey}.pkl"
+    try:
+        with open(entryPath, "rb") as f:
+            strat = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+    # Touch the entry so eviction is least-recently-used rather than oldest-written.
+    try:
+        os.utime(entryPath)
+    except OSError:
+        pass
+    return strat
+
+def writeStratCache(dataDir, cacheKey, strat):
+    os.makedirs(stratCacheDir(dataDir), exist_ok=True)
+    atomicWrite(f"{stratCacheDir(dataDir)}/{cacheKey}.pkl", pickle.dumps(strat))
+    evictStratCache(dataDir)
+
+def evictStratCache(dataDir, maxEntries=None):
+    # Only called after a cache miss, which already paid for an E probe,
+    # so scanning the directory here is cheap by comparison.
+    maxEntries = STRAT_CACHE_MAX_ENTRIES if maxEntries is None else maxEntries
+    entries = [e for e in os.scandir(stratCacheDir(dataDir)) if e.name.endswith(".pkl")]
+    if len(entries) <= maxEntries:
+        return
+
+    entries.sort(key=lambda e: e.stat().st_mtime)
+    # Evict down to 90% of the bound so we don't rescan on every following miss.
+    for e in entries[:len(entries) - int(0.9 * maxEntries)]:
+        try:
+            os.remove(e.path)
+        except OSError:
+            pass
+
+def atomicWrite(path, data):
+    tmpPath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmpPath, "wb") as f:
+        f.write(data)
+    os.replace(tmpPath, path)
+
+
+
+
+
+###### Strategy daemon client ##############################
+# stratDaemon.py can keep the history and master strategy of a data dir in
+# memory. Messages are length-prefixed pickles over a Unix socket in the data
+# dir; when no daemon answers, callers fall back to the file-based path.
+
+def daemonSocketPath(dataDir):
+    return f"{dataDir}/strat_daemon.sock"
+
+def sendMessage(sock, obj):
+    data = pickle.dumps(obj)
+    sock.sendall(len(data).to_bytes(8, "big") + data)
+
+def recvMessage(sock):
+    def recvExactly(n):
+        buf = bytearray()
+        while len(buf) < n:
+            chunk = sock.recv(n - len(buf))
+            if not chunk:
+                raise ConnectionError("Connection closed mid-message")
+            buf += chunk
+        return bytes(buf)
+
+    return pickle.loads(recvExactly(int.from_bytes(recvExactly(8), "big")))
+
+def requestDaemon(dataDir, request, timeout=10):
+    # Returns the daemon's reply, or None if no daemon is serving dataDir.
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(daemonSocketPath(dataDir))
+            sendMessage(sock, request)
+            return recvMessage(sock)
+    except OSError:
+        return None
+
+def requestStratPathsFromDaemon(dataDir, newStrat=None, topK=0, record=True):
+    # [master path] + the paths of the topK historical strategies, as in getStratPaths.
+    op = "update" if newStrat is not None and record else "master"
+    reply = requestDaemon(dataDir, {"op": op, "strat": newStrat, "topK": topK})
+    return None if reply is None else list(dict.fromkeys([reply["master"]] + reply["top"]))
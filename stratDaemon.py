@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+# Optional long-running server that keeps a data dir's strategy history and
+# master strategy in memory, so incrementalEWrapper.py calls don't each have
+# to load the history from disk:
+# 1.) It listens on $DATA_DIR/strat_daemon.sock (see stratClient.requestDaemon).
+# 2.) An "update" request adds the client's probed strategy to the in-memory
+#     history and replies with the path of the current MASTER.<hash>.strat
+#     (or of its cluster's CLUSTER.<hash>.strat, with SLH_STRAT_CLUSTERS).
+#     A "master" request just replies with that path. Either can also ask for
+#     the paths of the topK most common historical strategies (for portfolios).
+# 3.) New strategies are appended to strat_history.log in batches (every
+#     --flushEvery updates or --flushInterval seconds, and on shutdown), so
+#     the history on disk stays the source of truth for file-based callers.
+# 4.) Records other processes append to the log are folded in before each
+#     request is answered, so the daemon and file-based callers can be mixed.
+#
+# Usage: python stratDaemon.py $SLH_PERSISTENT_DATA_DIR
+
+import os
+import signal
+import argparse
+import threading
+import socketserver
+
+from helpers import loadStratSnapshot, foldStratLog, updateStratHistory, appendStratHistory, \
+    makeMasterFromHistory, clusterMasterPath, writeTopStrats, stratLogNeedsCompaction, compactStratHistoryInBackground, \
+    obtainLock, releaseLock, dataDirLockPath
+from stratClient import daemonSocketPath, requestDaemon, sendMessage, recvMessage
+
+
+class StratDaemon:
+
+    def __init__(self, dataDir, flushEvery=100, flushInterval=5.0):
+        self.dataDir = dataDir
+        self.flushEvery = flushEvery
+        self.flushInterval = flushInterval
+
+        self.hist, self.offset = loadStratSnapshot(dataDir)
+        self.offset = foldStratLog(self.hist, dataDir, self.offset)
+        self.pending = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def handle(self, request):
+        with self.lock:
+            # Pick up anything file-based callers appended since the last request.
+            self.offset = foldStratLog(self.hist, self.dataDir, self.offset, skipPid=os.getpid())
+            if request["op"] == "update":
+                updateStratHistory(self.hist, request["strat"])
+                self.pending.append(request["strat"])
+            masterStratPath = clusterMasterPath(self.hist, self.dataDir, request.get("strat")) \
+                or makeMasterFromHistory(self.hist, self.dataDir)
+            topStratPaths = writeTopStrats(self.hist, self.dataDir, request.get("topK", 0))
+
+        if len(self.pending) >= self.flushEvery:
+            self.flush()
+        return {"master": masterStratPath, "top": topStratPaths}
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+        if len(pending) == 0:
+            return
+
+        lock = obtainLock(dataDirLockPath(self.dataDir))
+        if lock is None:
+            print("Timed out waiting for the data dir lock; will retry the flush")
+            with self.lock:
+                self.pending = pending + self.pending
+            return
+        appendStratHistory(self.dataDir, *pending)
+        releaseLock(lock)
+
+        if stratLogNeedsCompaction(self.dataDir):
+            compactStratHistoryInBackground(self.dataDir)
+
+    def flushPeriodically(self):
+        while not self.stopped.wait(self.flushInterval):
+            self.flush()
+
+
+class RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sendMessage(self.request, self.server.daemon.handle(recvMessage(self.request)))
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(dataDir, flushEvery, flushInterval):
+    os.makedirs(dataDir, exist_ok=True)
+    socketPath = daemonSocketPath(dataDir)
+    if os.path.exists(socketPath):
+        if requestDaemon(dataDir, {"op": "master"}) is not None:
+            print(f"A daemon is already serving {dataDir}")
+            return
+        os.remove(socketPath) # Left behind by a daemon that crashed.
+
+    daemon = StratDaemon(dataDir, flushEvery, flushInterval)
+    oldUmask = os.umask(0o177) # Requests are pickles, so only we may connect.
+    server = DaemonServer(socketPath, RequestHandler)
+    os.umask(oldUmask)
+    server.daemon = daemon
+
+    flusher = threading.Thread(target=daemon.flushPeriodically, daemon=True)
+    flusher.start()
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+
+    print(f"Serving strategy history for {dataDir} on {socketPath}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socketPath)
+        daemon.stopped.set()
+        daemon.flush()
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dataDir")
+    parser.add_argument("--flushEvery", type=int, default=100, help="append to the history log after this many updates")
+    parser.add_argument("--flushInterval", type=float, default=5.0, help="...or after this many seconds")
+    args = parser.parse_args()
+
+    serve(args.dataDir, args.flushEvery, args.flushInterval)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+# A compact form of many strategies, for merging over large corpora (needs numpy):
+# - StratVocab interns every key, and every value of each key (heuristic_defs
+#   included), as small integers, so a strategy is a vector of value IDs (-1
+#   where a key is missing) and a corpus is one int32 matrix.
+# - parseStratDir turns a directory of E --print-strategy outputs into such a
+#   matrix in one pass. Each distinct value text is parsed only once.
+# - StratCounts holds one array of counts per key. Whole matrices are added
+#   with a bincount per key, and its master() is an argmax per key, so it can be
+#   used anywhere a strategy history can (updateStratHistory, makeMasterFromHistory).
+#
+# Usage: python stratVectors.py path/to/strategy/outputs --dataDir=path/to/data_dir
+
+import os
+import re
+import time
+import argparse
+import numpy as np
+
+from stratClient import parseStratValue, parseHeuristicDef
+from helpers import scaleHeuristicWeights, makeMasterFromHistory
+
+STRAT_LINE = re.compile(r"^[ \t]*(\w+)[ \t]*:[ \t]*(.*?)[ \t]*$", re.MULTILINE) # Not matching "# Name : value" comments.
+
+
+class StratVocab:
+
+    def __init__(self):
+        self.keys = []      # keyId -> key
+        self.keyIds = {}    # key -> keyId
+        self.values = []    # keyId -> [value], by valueId
+        self.valueIds = []  # keyId -> {value: valueId}
+        self.textIds = {}   # (key, value as E prints it) -> (keyId, valueId)
+
+    def keyId(self, key):
+        if key not in self.keyIds:
+            self.keyIds[key] = len(self.keys)
+            self.keys.append(key)
+            self.values.append([])
+            self.valueIds.append({})
+        return self.keyIds[key]
+
+    def valueId(self, keyId, value):
+        ids = self.valueIds[keyId]
+        if value not in ids:
+            ids[value] = len(self.values[keyId])
+            self.values[keyId].append(value)
+        return ids[value]
+
+    def textIdPair(self, key, text):
+        # (keyId, valueId) of a key and the unparsed text of its value.
+        pair = self.textIds.get((key, text))
+        if pair is None:
+            keyId = self.keyId(key)
+            value = parseHeuristicDef(text) if key == "heuristic_def" else parseStratValue(text)
+            pair = self.textIds[key, text] = (keyId, self.valueId(keyId, value))
+        return pair
+
+    def encode(self, strat):
+        ids = [(self.keyId(k), v) for k, v in strat.items()]
+        vector = np.full(len(self.keys), -1, dtype=np.int32)
+        for keyId, v in ids:
+            vector[keyId] = self.valueId(keyId, v)
+        return vector
+
+    def encodeText(self, text):
+        # The vector of a --print-strategy block (or of a whole E output containing one).
+        ids = [self.textIdPair(key, value) for key, value in STRAT_LINE.findall(text)]
+        vector = np.full(len(self.keys), -1, dtype=np.int32)
+        for keyId, valueId in ids:
+            vector[keyId] = valueId
+        return vector
+
+    def decode(self, vector):
+        return {self.keys[k]: self.values[k][v] for k, v in enumerate(vector) if v >= 0}
+
+    def heuristicWeights(self):
+        # (CEFs, matrix of each heuristic_def's weight for each CEF), so that
+        # counts @ matrix sums the weights of the CEFs over the counted heuristics.
+        heuristics = self.values[self.keyIds["heuristic_def"]]
+        cefs = list(dict.fromkeys(cef for h in heuristics for _, cef in h))
+        cefIds = {cef: i for i, cef in enumerate(cefs)}
+        weights = np.zeros((len(heuristics), len(cefs)))
+        for i, h in enumerate(heuristics):
+            for w, cef in h:
+                weights[i, cefIds[cef]] += w
+        return cefs, weights
+
+
+def stackVectors(vectors, numKeys):
+    # Vectors encoded before later keys were interned are shorter; pad them with -1.
+    matrix = np.full((len(vectors), numKeys), -1, dtype=np.int32)
+    for i, v in enumerate(vectors):
+        matrix[i, :len(v)] = v
+    return matrix
+
+def parseStratDir(directory, vocab=None):
+    # (vocab, matrix with a row per file, file names) for every file in directory.
+    vocab = StratVocab() if vocab is None else vocab
+    names, vectors = [], []
+    for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+        if not entry.is_file():
+            continue
+        with open(entry.path, errors="replace") as f:
+            vectors.append(vocab.encodeText(f.read()))
+        names.append(entry.name)
+    return vocab, stackVectors(vectors, len(vocab.keys)), names
+
+
+
+class StratCounts:
+    # How often each value of each key was seen, as arrays indexed by valueId.
+
+    def __init__(self, vocab=None):
+        self.vocab = StratVocab() if vocab is None else vocab
+        self.counts = [] # keyId -> np.ndarray of counts
+
+    def grow(self):
+        for k in range(len(self.vocab.keys)):
+            if k == len(self.counts):
+                self.counts.append(np.zeros(0))
+            n = len(self.vocab.values[k])
+            if len(self.counts[k]) < n:
+                self.counts[k] = np.concatenate([self.counts[k], np.zeros(n - len(self.counts[k]))])
+
+    def add(self, strat, weight=1):
+        vector = self.vocab.encode(strat)
+        self.grow()
+        for k, v in enumerate(vector):
+            if v >= 0:
+                self.counts[k][v] += weight
+
+    def addMatrix(self, matrix, weight=1):
+        # matrix must have been encoded with self.vocab.
+        self.grow()
+        for k in range(matrix.shape[1]):
+            column = matrix[:, k]
+            self.counts[k] += weight * np.bincount(column[column >= 0], minlength=len(self.counts[k]))
+
+    def copy(self):
+        other = StratCounts(self.vocab)
+        other.counts = [c.copy() for c in self.counts]
+        return other
+
+    def __sub__(self, other):
+        # Counts over self's strategies minus other's (with the same vocab), e.g. for a training fold.
+        result = self.copy()
+        other.grow()
+        result.grow()
+        for k, c in enumerate(other.counts):
+            result.counts[k] -= c
+        return result
+
+    def master(self, all_ones=False):
+        # As makeMasterStrat: the most common value of each key (the first seen on ties,
+        # as Counter.most_common does), with heuristic_def merged by CEF weight.
+        self.grow() # The vocab may be shared, and have values interned since these counts last grew.
+        master = {}
+        for k, key in enumerate(self.vocab.keys):
+            counts = self.counts[k]
+            if len(counts) == 0 or counts.max() <= 0:
+                continue
+            if key == "heuristic_def":
+                cefs, weights = self.vocab.heuristicWeights()
+                cefWeights = np.maximum(counts, 0) @ weights
+                master[key] = scaleHeuristicWeights({cef: w for cef, w in zip(cefs, cefWeights) if w > 0}, all_ones)
+            else:
+                master[key] = self.vocab.values[k][int(np.argmax(counts))]
+        return master
+
+
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("stratDir", help="directory of E --print-strategy outputs, one file per problem")
+    parser.add_argument("--dataDir", default=None, help="write the merged MASTER.<hash>.strat here")
+    args = parser.parse_args()
+
+    t1 = time.perf_counter()
+    vocab, matrix, names = parseStratDir(args.stratDir)
+    t2 = time.perf_counter()
+    counts = StratCounts(vocab)
+    counts.addMatrix(matrix)
+    t3 = time.perf_counter()
+    print(f"Parsed {len(names)} strategies ({len(vocab.keys)} keys, "
+          f"{sum(len(v) for v in vocab.values)} distinct values) in {t2 - t1:.2f} s, counted in {t3 - t2:.3f} s")
+
+    if args.dataDir is not None:
+        os.makedirs(args.dataDir, exist_ok=True)
+        print(makeMasterFromHistory(counts, args.dataDir))
+    else:
+        print(counts.master())
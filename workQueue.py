@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+# A job table for running one experiment on many nodes at once:
+# 1.) `create` puts the experiment's settings and one job per problem into a
+#     SQLite database, which has to be on a filesystem every node can see.
+# 2.) `work` starts a worker process that claims problems (numWorkers at a time),
+#     runs E on them as incrementalExperiments.runE does and writes the results
+#     back. Start as many as you like, on any host that shares the directory.
+# 3.) A claim is a lease, which the worker renews (heartbeat) while E runs. The
+#     jobs of a worker that dies stop being renewed, and are queued again once
+#     their lease expires (at most --maxAttempts times per job).
+# 4.) `status` counts the jobs in each state, and `collect` writes the results
+#     out as {name}.results.jsonl/.pkl, like Experiment.run would have.
+#
+# Usage:
+#   python workQueue.py create sweep.db ExperimentName path/to/problems --eArgs="--auto --cpu-limit=60"
+#   python workQueue.py work sweep.db --numWorkers=8     # on every node
+#   python workQueue.py collect sweep.db
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from helpers import listProblems
+from incrementalExperiments import Experiment, runE, errorResult
+
+
+class WorkQueue:
+
+    def __init__(self, path, leaseSeconds=300, maxAttempts=3):
+        self.path = path
+        self.leaseSeconds = leaseSeconds
+        self.maxAttempts = maxAttempts
+
+    @contextmanager
+    def connect(self):
+        # A connection per operation, so any thread may use the queue. The busy
+        # timeout covers other workers holding the database's write lock, and
+        # closing the connection rolls back a transaction an exception cut short.
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def create(self, header, problems):
+        # Jobs are claimed in the order given. Creating an existing queue again
+        # only adds the problems it doesn't have yet.
+        with self.connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY, problem TEXT UNIQUE, state TEXT DEFAULT 'queued',
+                worker TEXT, leaseExpires REAL, attempts INTEGER DEFAULT 0, result TEXT)""")
+            db.execute("CREATE INDEX IF NOT EXISTS jobsByState ON jobs (state, id)")
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('experiment', ?)", (json.dumps(header),))
+            db.executemany("INSERT OR IGNORE INTO jobs (problem) VALUES (?)", [(p,) for p in problems])
+            db.execute("COMMIT")
+
+    def header(self):
+        with self.connect() as db:
+            return json.loads(db.execute("SELECT value FROM meta WHERE key = 'experiment'").fetchone()[0])
+
+    def claim(self, worker):
+        # The next queued problem, now leased to worker, or None if there is none.
+        now = time.time()
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            self.requeueExpired(db, now)
+            row = db.execute("SELECT id, problem FROM jobs WHERE state = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is not None:
+                db.execute("UPDATE jobs SET state = 'leased', worker = ?, leaseExpires = ?, attempts = attempts + 1 WHERE id = ?",
+                           (worker, now + self.leaseSeconds, row["id"]))
+            db.execute("COMMIT")
+        return None if row is None else row["problem"]
+
+    def requeueExpired(self, db, now):
+        db.execute("UPDATE jobs SET state = 'failed', worker = NULL "
+                   "WHERE state = 'leased' AND leaseExpires < ? AND attempts >= ?", (now, self.maxAttempts))
+        db.execute("UPDATE jobs SET state = 'queued', worker = NULL "
+                   "WHERE state = 'leased' AND leaseExpires < ?", (now,))
+
+    def heartbeat(self, worker):
+        # Renew every lease worker holds.
+        with self.connect() as db:
+            db.execute("UPDATE jobs SET leaseExpires = ? WHERE worker = ? AND state = 'leased'",
+                       (time.time() + self.leaseSeconds, worker))
+
+    def complete(self, worker, problem, result):
+        # The first result for a problem wins, even if its lease had expired
+        # and the problem was claimed again in the meantime.
+        with self.connect() as db:
+            db.execute("UPDATE jobs SET state = 'done', worker = ?, result = ? WHERE problem = ? AND state != 'done'",
+                       (worker, json.dumps(result), problem))
+
+    def release(self, worker, problem):
+        # Give up a claim without a result, e.g. when the worker is interrupted.
+        with self.connect() as db:
+            db.execute("UPDATE jobs SET state = 'queued', worker = NULL, attempts = attempts - 1 "
+                       "WHERE problem = ? AND worker = ? AND state = 'leased'", (problem, worker))
+
+    def counts(self):
+        with self.connect() as db:
+            return {row["state"]: row["n"] for row in db.execute("SELECT state, count(*) AS n FROM jobs GROUP BY state")}
+
+    def results(self):
+        with self.connect() as db:
+            rows = db.execute("SELECT result FROM jobs WHERE state = 'done' ORDER BY id").fetchall()
+        return [json.loads(row["result"]) for row in rows]
+
+
+
+def workerName():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def work(queue, numWorkers=4):
+    # Claim and run problems on numWorkers threads until every job is done or failed.
+    header = queue.header()
+    worker = workerName()
+    problemStrats = header.get("problemStrats") or {}
+    stopped = threading.Event()
+
+    def heartbeat():
+        while not stopped.wait(queue.leaseSeconds / 3):
+            queue.heartbeat(worker)
+
+    def runJobs():
+        numDone = 0
+        while not stopped.is_set():
+            problem = queue.claim(worker)
+            if problem is None:
+                if queue.counts().get("leased", 0) == 0:
+                    break
+                # Wait in case a lease expires (its worker died) and the problem is queued again.
+                stopped.wait(min(queue.leaseSeconds / 3, 10))
+                continue
+            try:
+                result = runE(header["useDataDir"], header["dataDirPath"], header["eArgs"], problem, header["higherOrder"],
+                              stratPath=problemStrats.get(problem))
+            except Exception as e:
+                result = errorResult(problem, e) # Like any other result, so the job isn't claimed again and again.
+            except (KeyboardInterrupt, SystemExit):
+                queue.release(worker, problem)
+                raise
+            queue.complete(worker, problem, result)
+            numDone += 1
+        return numDone
+
+    heartbeats = threading.Thread(target=heartbeat, daemon=True)
+    heartbeats.start()
+    try:
+        with ThreadPoolExecutor(numWorkers) as pool:
+            numDone = sum(f.result() for f in [pool.submit(runJobs) for _ in range(numWorkers)])
+    finally:
+        stopped.set()
+    print(f"{worker}: attempted {numDone} problems; queue: {queue.counts()}")
+
+def enqueue(queue, exp):
+    header = {"name": exp.name, "path": exp.path, "higherOrder": exp.higherOrder, "problems": exp.problems,
+              "eArgs": exp.eArgs, "useDataDir": exp.useDataDir, "dataDirPath": exp.dataDirPath,
+              "problemStrats": exp.problemStrats}
+    queue.create(header, exp.problems)
+
+def collect(queue):
+    # Record every finished job in a fresh Experiment, as if it had run locally.
+    header = queue.header()
+    exp = Experiment(header["name"], header["path"], header["higherOrder"], header["problems"],
+                     header["eArgs"], header["useDataDir"], header["dataDirPath"], header.get("problemStrats"))
+    exp.openLog(resume=False)
+    for result in queue.results():
+        exp.record(result)
+
+    counts = queue.counts()
+    exp.finished = counts.get("queued", 0) + counts.get("leased", 0) == 0
+    if exp.finished:
+        exp.log.write(json.dumps({"finished": True}) + "\n")
+    exp.log.close()
+    exp.log = None
+    exp.save()
+    print(exp)
+    return exp
+
+
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["create", "work", "status", "collect"])
+    parser.add_argument("queue", help="path of the SQLite job table, on a filesystem all workers share")
+    parser.add_argument("name", nargs="?")
+    parser.add_argument("problemsPath", nargs="?")
+    parser.add_argument("--manifest", default=None, help="only queue the problems listed (one per line) in this file")
+    parser.add_argument("--useDataDir", action="store_true")
+    parser.add_argument("--dataDirPath", default="data_dir")
+    parser.add_argument("--higherOrder", action="store_true")
+    parser.add_argument("--eArgs", default="")
+    parser.add_argument("--numWorkers", type=int, default=4, help="problems each worker process runs at once")
+    parser.add_argument("--leaseSeconds", type=float, default=300, help="how long a claim lasts without a heartbeat (longer than E's cpu limit is safest)")
+    parser.add_argument("--maxAttempts", type=int, default=3, help="claims per problem before it is marked failed")
+    args = parser.parse_args()
+
+    queue = WorkQueue(args.queue, args.leaseSeconds, args.maxAttempts)
+    if args.command == "create":
+        if args.name is None or args.problemsPath is None:
+            parser.error("create needs a name and a problemsPath")
+        enqueue(queue, Experiment(args.name, args.problemsPath, args.higherOrder, listProblems(args.problemsPath, args.manifest),
+                                  args.eArgs, args.useDataDir, args.dataDirPath))
+        print(f"Queue {args.queue}: {queue.counts()}")
+    elif args.command == "work":
+        work(queue, args.numWorkers)
+    elif args.command == "status":
+        print(queue.counts())
+    else:
+        collect(queue)